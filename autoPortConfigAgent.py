@@ -3,7 +3,19 @@
 #### http://aristanetworks.github.io/EosSdk/docs/2.19.0/ref/
 ##  updates
 
-import eossdk, yaml, json, sys, pyeapi, uuid, io, urllib.request, subprocess
+import yaml, json, sys, uuid, io, array, bisect, mmap, resource, urllib.request, urllib.error, ctypes, hashlib, string, collections, heapq, os, queue, threading, time, argparse, csv, itertools, operator, http.client, socket, sqlite3
+
+# the sdk and eapi are only there on a switch.  the offline classify mode runs without
+#  them, and uses numpy for the mac tables when it is installed
+try:
+    import eossdk, pyeapi
+except ImportError:
+    eossdk = pyeapi = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 class lldpCapsEnum:
     isOther = 0
@@ -18,35 +30,1401 @@ class lldpCapsEnum:
 def formatMac(mac):
     return mac.replace(':', '').replace('.','').replace('-', '').strip().lower()
 
+# convert a formatted mac (or oui) string to its integer value.  returns None if
+#  the string isn't exactly the expected number of hex digits
+def macToInt(mac, digits=12):
+    if len(mac) != digits or mac.strip(string.hexdigits):
+        return None
+    return int(mac, 16)
+
+# configs with at least this many macs keep their own sorted array (or the mapped
+#  sidecar file) rather than having it copied into the shared table
+largeMacList = 4096
+
+# the most lldp neighbors whose classification is remembered, the least recently seen
+#  are forgotten first
+lldpNeighborCacheSize = 16384
+
+# the macRuleIndex compiles the macs and ouis of every config into tables keyed on the
+#  integer value of the address.  each entry remembers the position of the first config
+#  in the file that lists it, so a lookup gives the same answer as walking the configs
+#  in order: the earliest config with either a specific mac or an oui match wins.  the
+#  mac table is one sorted array('Q') of the mac shifted up 16 bits with the position
+#  in the low bits, 8 bytes a mac, and the large lists are searched where they are
+class macRuleIndex:
+    def __init__(self, configs):
+        if len(configs) > 0xffff:
+            raise Exception("too many configs for the mac index")
+
+        self.configs = [config['config'] for config in configs]
+        self.ouis = {}
+        self.large = []
+        # sorted numpy views of the tables, built the first time a batch is looked up
+        self.tables = None
+
+        entries = []
+        for position, config in enumerate(self.configs):
+            # the macs are already sorted integers, parseConfig dropped anything that
+            #  isn't a full 48 bit address
+            macs = config.get('macs', ())
+            if len(macs) >= largeMacList:
+                self.large.append((position, macs))
+            else:
+                entries.extend((key << 16) | position for key in macs)
+            for oui in config.get('ouis', []):
+                key = macToInt(oui, 6)
+                if key is not None:
+                    self.ouis.setdefault(key, position)
+        # sorted on the mac then the position, so the first entry for a mac is the earliest config
+        self.macs = array.array('Q', sorted(entries))
+
+    # the position of the first config listing the mac, or -1
+    def macPosition(self, key):
+        macs = self.macs
+        i = bisect.bisect_left(macs, key << 16)
+        position = macs[i] & 0xffff if i < len(macs) and macs[i] >> 16 == key else -1
+        for largePosition, keys in self.large:
+            if 0 <= position < largePosition:
+                break
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                return largePosition
+        return position
+
+    def lookup(self, mac):
+        key = macToInt(mac, 12)
+        if key is None:
+            return None
+
+        # when both match, the config that appears first in the file wins
+        position = self.macPosition(key)
+        ouiPosition = self.ouis.get(key >> 24, -1)
+        if ouiPosition >= 0 and (position < 0 or ouiPosition < position):
+            position = ouiPosition
+        return self.configs[position] if position >= 0 else None
+
+    # the number of macs in the index, the bytes they take in memory, and the bytes
+    #  mapped from sidecar files
+    def size(self):
+        count, resident, mapped = len(self.macs), len(self.macs) * 8, 0
+        for _, keys in self.large:
+            count += len(keys)
+            if isinstance(keys, memoryview):
+                mapped += len(keys) * 8
+            else:
+                resident += len(keys) * 8
+        return count, resident, mapped
+
+    # the positions of the configs matching each of a batch of macs, on the mac and on
+    #  the oui, with -1 where there is no match.  with numpy the whole batch is joined
+    #  against the sorted tables at once, otherwise it's a search per mac
+    def lookupPositions(self, macs):
+        if numpy is None:
+            keys = [macToInt(mac, 12) for mac in macs]
+            return ([self.macPosition(key) if key is not None else -1 for key in keys],
+                    [self.ouis.get(key >> 24, -1) if key is not None else -1 for key in keys])
+
+        if self.tables is None:
+            entries = numpy.frombuffer(self.macs, dtype=numpy.uint64) if len(self.macs) else numpy.zeros(0, dtype=numpy.uint64)
+            self.tables = [(entries >> numpy.uint64(16), (entries & numpy.uint64(0xffff)).astype(numpy.int64)),
+                           sortedTable(self.ouis),
+                           [(position, numpy.frombuffer(macs, dtype=numpy.uint64)) for position, macs in self.large if len(macs)]]
+        keys = macKeys(macs)
+        positions = joinSorted(self.tables[0], keys)
+        for position, table in self.tables[2]:
+            found = table[numpy.minimum(numpy.searchsorted(table, keys), len(table) - 1)] == keys
+            positions = numpy.where(found & ((positions < 0) | (positions > position)), position, positions)
+        return (positions.tolist(),
+                joinSorted(self.tables[1], keys >> numpy.uint64(24)).tolist())
+
+# the integer values of a batch of macs, worked out on the character codes of the whole
+#  batch at once.  anything that isn't exactly 12 hex digits gets a key no mac or oui
+#  can equal
+def macKeys(macs):
+    codes = numpy.array(macs, dtype='U13').view(numpy.uint32).reshape(len(macs), 13).astype(numpy.int64)
+    digits = codes[:, :12]
+    lower = (digits >= 97) & (digits <= 102)
+    upper = (digits >= 65) & (digits <= 70)
+    valid = ((digits >= 48) & (digits <= 57) | lower | upper).all(axis=1) & (codes[:, 12] == 0)
+    values = numpy.where(lower, digits - 87, numpy.where(upper, digits - 55, digits - 48)).astype(numpy.uint64)
+
+    keys = numpy.zeros(len(macs), dtype=numpy.uint64)
+    for column in range(12):
+        keys = (keys << numpy.uint64(4)) | values[:, column]
+    keys[~valid] = numpy.uint64((1 << 64) - 1)
+    return keys
+
+# a mac or oui table as a sorted key array and the matching config positions
+def sortedTable(table):
+    keys = sorted(table)
+    return (numpy.array(keys, dtype=numpy.uint64),
+            numpy.array([table[key] for key in keys], dtype=numpy.int64))
+
+def joinSorted(table, keys):
+    tableKeys, positions = table
+    if not len(tableKeys):
+        return numpy.full(len(keys), -1, dtype=numpy.int64)
+    found = numpy.minimum(numpy.searchsorted(tableKeys, keys), len(tableKeys) - 1)
+    return numpy.where(tableKeys[found] == keys, positions[found], -1)
+
+# sort an array('Q') of macs, in place when numpy is there to do it
+def sortedMacs(macs):
+    if numpy is None:
+        return array.array('Q', sorted(macs))
+    if len(macs):
+        numpy.frombuffer(macs, dtype=numpy.uint64).sort()
+    return macs
+
+# packmacs starts its files with this, to say the macs after it are already sorted
+sortedMacsMagic = b'APCMACS\x01'
+
+# a binary sidecar file of macs as 8 byte native integers, mapped rather than read so a
+#  large list costs only the pages the lookups touch.  a file without the sorted header
+#  has its order checked, and if it isn't sorted is read into memory and sorted instead
+def mapMacs(path):
+    with open(path, 'rb') as fileHandle:
+        size = os.fstat(fileHandle.fileno()).st_size
+        if size % 8:
+            raise Exception("{} is not a whole number of 8 byte macs".format(path))
+        if size == 0:
+            return array.array('Q')
+        mapped = memoryview(mmap.mmap(fileHandle.fileno(), 0, access=mmap.ACCESS_READ))
+    if mapped[:8] == sortedMacsMagic:
+        return mapped[8:].cast('Q') if size > 8 else array.array('Q')
+
+    keys = mapped.cast('Q')
+    if all(map(operator.le, keys, itertools.islice(keys, 1, None))):
+        return keys
+    return sortedMacs(array.array('Q', keys))
+
+# a text sidecar file of macs, one a line in any of the usual formats, streamed into an
+#  array.  blank lines, comments and anything that isn't a mac are skipped
+def readMacs(path):
+    macs = array.array('Q')
+    with open(path, 'r') as fileHandle:
+        for line in fileHandle:
+            key = macToInt(formatMac(line.split('#', 1)[0]), 12)
+            if key is not None:
+                macs.append(key)
+    return macs
+
+# the commands of one state of a profile, compiled once when the config is loaded.
+#  applying it to an interface only needs the interface name filled in
+class commandPlan:
+    def __init__(self, commands):
+        self.commands = list(commands)
+        self.fingerprint = tuple(self.commands)
+        # what the running config shows for these commands
+        self.running = [command.strip() for command in self.commands]
+
+    def render(self, intfStr):
+        return ['default interface ' + intfStr, 'interface ' + intfStr] + self.commands
+
+# a small aho-corasick automaton.  every pattern added carries a value, and search()
+#  returns the set of values for all patterns found anywhere in the text in a single
+#  pass over it, no matter how many patterns there are
+class ahoCorasick:
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [set()]
+
+    def add(self, pattern, value):
+        node = 0
+        for ch in pattern:
+            nxt = self.goto[node].get(ch, None)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append(set())
+                self.goto[node][ch] = nxt
+            node = nxt
+        self.output[node].add(value)
+
+    def build(self):
+        # breadth first so that every fail target has its output merged before
+        #  any deeper node pulls from it
+        queue = collections.deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self.goto[node].items():
+                queue.append(nxt)
+                f = self.fail[node]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                self.fail[nxt] = self.goto[f].get(ch, 0)
+                self.output[nxt] |= self.output[self.fail[nxt]]
+
+    def search(self, text):
+        goto = self.goto
+        fail = self.fail
+        output = self.output
+
+        node = 0
+        matched = set()
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if output[node]:
+                matched.add(node)
+
+        result = set(output[0])
+        for node in matched:
+            result |= output[node]
+        return result
+
+# the lldpRuleMatcher compiles the lldp section of every config.  configs are bucketed
+#  by their capabilities integer and all the description and name substrings go into
+#  one automaton each, so a neighbor is checked against every config with two passes
+#  over its strings instead of one find() per substring per config
+class lldpRuleMatcher:
+    def __init__(self, configs):
+        # each entry is (config, caps, descriptions, names, macs, ouis) for a config
+        #  with an lldp section, in file order
+        self.entries = []
+        self.capsBuckets = {}
+        self.anyCaps = []
+        self.descriptions = ahoCorasick()
+        self.names = ahoCorasick()
+
+        for config in configs:
+            configLLDP = config['config'].get('lldp', None)
+            if not configLLDP:
+                # this config item doesn't have any lldp to check, skip it
+                continue
+
+            entry = len(self.entries)
+            caps = configLLDP.get('caps', None)
+            descriptions = configLLDP.get('descriptions', None)
+            names = configLLDP.get('names', None)
+
+            if caps == None:
+                self.anyCaps.append(entry)
+            else:
+                self.capsBuckets.setdefault(caps, []).append(entry)
+
+            for desc in descriptions or []:
+                self.descriptions.add(desc, entry)
+            for name in names or []:
+                self.names.add(name, entry)
+
+            self.entries.append((config['config'], caps, descriptions, names,
+                                 set(configLLDP.get('macs', [])), set(configLLDP.get('ouis', []))))
+
+        self.descriptions.build()
+        self.names.build()
+
+    # returns the first config where every check that applies passes.  a check only
+    #  applies if the config defines it and the neighbor sent the matching attribute,
+    #  just like the None/True/False results in the original search loop
+    def match(self, lldpCaps, mac, remoteDescription, remoteSystem):
+        return next(self.matches(lldpCaps, mac, remoteDescription, remoteSystem), None)
+
+    # every matching config in file order, the first one is the one that wins
+    def matches(self, lldpCaps, mac, remoteDescription, remoteSystem):
+        descHits = self.descriptions.search(remoteDescription.lower()) if remoteDescription else None
+        nameHits = self.names.search(remoteSystem.lower()) if remoteSystem else None
+
+        if lldpCaps:
+            # only configs without caps or with exactly these caps can match
+            candidates = heapq.merge(self.capsBuckets.get(lldpCaps, []), self.anyCaps)
+        else:
+            candidates = range(len(self.entries))
+
+        for entry in candidates:
+            config, caps, descriptions, names, macs, ouis = self.entries[entry]
+            if descHits is not None and descriptions is not None and entry not in descHits:
+                continue
+            if nameHits is not None and names is not None and entry not in nameHits:
+                continue
+            if mac and (macs or ouis) and mac not in macs and mac[:6] not in ouis:
+                continue
+            yield config
+
+# a thin wrapper around the sdk tracer.  messages are passed as a format string and
+#  arguments, and only formatted when that trace level is actually enabled, so trace
+#  calls on the hot paths cost next to nothing while tracing is off
+class lazyTracer:
+    def __init__(self, name):
+        tracerClass = eossdk.Tracer if eossdk else offlineTracer
+        self.tracer = tracerClass(name)
+        self.levels = [getattr(tracerClass, "Level{}".format(level), level) for level in range(10)]
+        self.emit = [getattr(self.tracer, "trace{}".format(level)) for level in range(10)]
+
+# without the sdk nothing is traced
+class offlineTracer:
+    def __init__(self, name):
+        pass
+
+    def enabled(self, level):
+        return False
+
+    def __getattr__(self, name):
+        return lambda msg: None
+
+def makeLazyTrace(level):
+    def trace(self, msg, *args):
+        if self.tracer.enabled(self.levels[level]):
+            self.emit[level](msg.format(*args) if args else msg)
+    return trace
+
+for level in range(10):
+    setattr(lazyTracer, "trace{}".format(level), makeLazyTrace(level))
+
+# collects the traces made on the reload thread, which mustn't call into the sdk, so
+#  the event loop can replay them into the real tracer once the reload is handed back
+class heldTracer:
+    def __init__(self):
+        self.held = []
+
+    def replay(self, tracer):
+        for level, msg, args in self.held:
+            getattr(tracer, "trace{}".format(level))(msg, *args)
+
+def makeHeldTrace(level):
+    def trace(self, msg, *args):
+        self.held.append((level, msg, args))
+    return trace
+
+for level in range(10):
+    setattr(heldTracer, "trace{}".format(level), makeHeldTrace(level))
+
+# a fixed size ring of the most recent classification decisions.  recording one is a
+#  single tuple append, formatting only happens when the ring is dumped
+class decisionRecorder:
+    def __init__(self, size=1000):
+        self.decisions = collections.deque(maxlen=size)
+
+    def record(self, intf, trigger, detail, profile, elapsed):
+        self.decisions.append((time.time(), intf, trigger, detail, profile, elapsed))
+
+    def dump(self, fileHandle):
+        for when, intf, trigger, detail, profile, elapsed in self.decisions:
+            fileHandle.write(json.dumps({'time':when, 'interface':intf, 'trigger':trigger, 'detail':detail,
+                                         'profile':profile, 'elapsedUs':round(elapsed * 1000000, 1)}) + "\n")
+
+# the profile each known device (a mac, or an lldp chassis id) was last classified onto,
+#  kept in sqlite on flash so it survives a restart.  entries belong to the config they
+#  were decided under and are dropped as soon as a different config is in use.  the
+#  rows for the current config are read into an lru the first time they are needed,
+#  and the least recently used are evicted past size.  lookups only touch the lru,
+#  what changed is written out in one transaction by flush.  if the database can't be
+#  used the store carries on in memory only
+class decisionStore:
+    def __init__(self, path, size=10000):
+        self.path = path
+        self.size = size
+        self.db = None
+        self.contentHash = None
+        self.entries = collections.OrderedDict()
+        # key -> (profile, lastUsed) still to be written, or None for a row to delete
+        self.dirty = {}
+
+    def get(self, key, contentHash):
+        if contentHash != self.contentHash:
+            self.load(contentHash)
+
+        profile = self.entries.get(key, None)
+        if profile is not None:
+            self.entries.move_to_end(key)
+            self.dirty[key] = (profile, time.time())
+        return profile
+
+    def put(self, key, profile, contentHash):
+        if contentHash != self.contentHash:
+            self.load(contentHash)
+        if self.entries.get(key, None) == profile:
+            return
+
+        self.entries[key] = profile
+        self.entries.move_to_end(key)
+        self.dirty[key] = (profile, time.time())
+        while len(self.entries) > self.size:
+            evicted, _ = self.entries.popitem(last=False)
+            self.dirty[evicted] = None
+
+    # write out the lookups and evictions since the last flush
+    def flush(self):
+        dirty, self.dirty = self.dirty, {}
+        if not self.db or not dirty:
+            return
+        try:
+            self.db.execute("BEGIN")
+            self.db.executemany("INSERT OR REPLACE INTO decisions VALUES (?, ?, ?, ?)",
+                                [(key, row[0], self.contentHash, row[1]) for key, row in dirty.items() if row])
+            self.db.executemany("DELETE FROM decisions WHERE key=?", [(key,) for key, row in dirty.items() if not row])
+            self.db.execute("COMMIT")
+        except sqlite3.Error:
+            self.db.close()
+            self.db = False
+
+    def load(self, contentHash):
+        # anything not yet written belongs to the config being replaced
+        self.contentHash = contentHash
+        self.entries.clear()
+        self.dirty.clear()
+        if self.db is None:
+            try:
+                self.db = sqlite3.connect(self.path, isolation_level=None)
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute("PRAGMA synchronous=NORMAL")
+                self.db.execute("CREATE TABLE IF NOT EXISTS decisions "
+                                "(key TEXT PRIMARY KEY, profile TEXT, contentHash TEXT, lastUsed REAL)")
+            except sqlite3.Error:
+                self.db = False
+        if not self.db:
+            return
+
+        self.execute("DELETE FROM decisions WHERE contentHash!=?", (contentHash,))
+        rows = self.execute("SELECT key, profile, lastUsed FROM decisions ORDER BY lastUsed DESC LIMIT ?", (self.size,))
+        for key, profile, _ in reversed(rows or []):
+            self.entries[key] = profile
+        if rows and len(rows) == self.size:
+            self.execute("DELETE FROM decisions WHERE lastUsed<?", (rows[-1][2],))
+
+    def execute(self, statement, args):
+        if not self.db:
+            return None
+        try:
+            return self.db.execute(statement, args).fetchall()
+        except sqlite3.Error:
+            self.db.close()
+            self.db = False
+            return None
+
+    def close(self):
+        self.flush()
+        if self.db:
+            self.db.close()
+        self.db = None
+        self.contentHash = None
+
+# counters and latency histograms for the hot paths.  both are just a dict update so
+#  they can stay on during a mac learn flood.  latencies go into power of two buckets
+#  of microseconds, which is plenty to tell 5us from 500us
+class agentMetrics:
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.histograms = {}
+        # values where only the latest matters, like a queue depth
+        self.gauges = {}
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def gauge(self, name, value):
+        self.gauges[name] = value
+
+    def observe(self, name, seconds):
+        histogram = self.histograms.get(name, None)
+        if histogram is None:
+            histogram = self.histograms[name] = [0] * 40
+        histogram[min(int(seconds * 1000000).bit_length(), 39)] += 1
+
+    # fold in what another thread recorded.  only call this from the thread that owns self
+    def merge(self, other):
+        self.counters.update(other.counters)
+        self.gauges.update(other.gauges)
+        for name, histogram in other.histograms.items():
+            mine = self.histograms.get(name, None)
+            if mine is None:
+                self.histograms[name] = list(histogram)
+            else:
+                self.histograms[name] = list(map(operator.add, mine, histogram))
+
+    # the upper bound, in microseconds, of the bucket holding the given percentile
+    def percentile(self, name, fraction):
+        histogram = self.histograms.get(name, [])
+        target = sum(histogram) * fraction
+        seen = 0
+        for bucket, count in enumerate(histogram):
+            seen += count
+            if count and seen >= target:
+                return 1 << bucket
+        return 0
+
+    def summary(self):
+        result = dict(self.counters)
+        result.update(self.gauges)
+        for name, histogram in self.histograms.items():
+            result[name] = "count={} p50<={}us p99<={}us max<={}us".format(sum(histogram),
+                    self.percentile(name, 0.5), self.percentile(name, 0.99),
+                    1 << max(bucket for bucket, count in enumerate(histogram) if count) if any(histogram) else 0)
+        return result
+
+# the states an interface we monitor can be in.  the two waiting states are bits so a
+#  port that has just come up can wait on a mac learn and an lldp neighbor at once
+class intfStateEnum:
+    isIdle = 0
+    isWaitingMac = 1
+    isWaitingLLDP = 2
+    isConfigured = 4
+    isSettled = 8
+
+# per interface tracking record.  since is the monotonic time of the last change of
+#  state, so we always know how long a port has been waiting or configured
+# the mac handler sees every learn on the switch, so it looks interfaces up by the
+#  IntfId hash instead of building a name string for each one.  sdks without hash()
+#  fall back to the name
+if eossdk and hasattr(eossdk.IntfId, "hash"):
+    intfKey = eossdk.IntfId.hash
+elif eossdk:
+    intfKey = eossdk.IntfId.to_string
+
+# the mac an lldp neighbor sends as its port id, when it sends one.  swig hands the raw
+#  id over as a str decoded with surrogateescape, so encoding it the same way gives the
+#  six bytes back
+def lldpIntfMac(lldpIntfId):
+    if lldpIntfId.encoding() != eossdk.LLDP_INTF_MAC_ADDR:
+        return None
+    value = lldpIntfId.value()
+    if isinstance(value, str):
+        value = value.encode('utf-8', 'surrogateescape')
+    return value.hex() if len(value) == 6 else None
+
+class intfState:
+    __slots__ = ('name', 'key', 'state', 'since')
+
+    def __init__(self, name):
+        self.name = name
+        self.key = intfKey(eossdk.IntfId(name))
+        self.state = intfStateEnum.isIdle
+        self.since = time.monotonic()
+
+# the orderedWorkerPool runs eapi work on background threads so the sdk event loop
+#  never waits on a commit.  every job has a key (normally the interface name) and
+#  all jobs with the same key go to the same thread, so they run in the order they
+#  were submitted while different keys run concurrently.  a job with a lower priority
+#  number goes ahead of anything already waiting on its thread, so jobs that share a
+#  key must share a priority.  finished jobs are handed back through a pipe that the
+#  agent watches from the sdk event loop
+class orderedWorkerPool:
+    def __init__(self, workers, connect):
+        self.results = collections.deque()
+        self.readFd, self.writeFd = os.pipe()
+        os.set_blocking(self.readFd, False)
+        self.pending = 0
+        self.sequence = itertools.count()
+        self.queues = []
+        for _ in range(workers):
+            jobs = queue.PriorityQueue()
+            self.queues.append(jobs)
+            threading.Thread(target=self.run, args=(jobs, connect), daemon=True).start()
+
+    def run(self, jobs, connect):
+        # each thread gets its own eapi connection, they aren't safe to share
+        node = connect()
+        while True:
+            _, _, fn, callback = jobs.get()
+            if fn is None:
+                break
+
+            start = time.monotonic()
+            try:
+                result, error = fn(node), None
+            except Exception as e:
+                result, error = None, e
+            self.results.append((callback, result, error, time.monotonic() - start, takeMetrics(node)))
+            os.write(self.writeFd, b'.')
+
+    def submit(self, key, fn, callback, priority=0):
+        self.pending += 1
+        self.queues[hash(key) % len(self.queues)].put((priority, next(self.sequence), fn, callback))
+
+    # returns every finished job as (callback, result, error, latency, metrics), metrics
+    #  being what the job's eapi connection recorded, if anything.  only call this from
+    #  the sdk event loop
+    def drain(self):
+        try:
+            while os.read(self.readFd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        finished = []
+        while self.results:
+            finished.append(self.results.popleft())
+        self.pending -= len(finished)
+        return finished
+
+    # let the threads finish anything already queued, then exit
+    def stop(self):
+        for jobs in self.queues:
+            jobs.put((float('inf'), next(self.sequence), None, None))
+
+    def close(self):
+        os.close(self.readFd)
+        os.close(self.writeFd)
+
+# whether an eapi call failed because the switch refused a command, rather than
+#  because it couldn't be reached
+def commandRefused(e):
+    if isinstance(e, eapiError):
+        return e.results is not None
+    return pyeapi is not None and isinstance(e, pyeapi.eapilib.CommandError)
+
+class eapiError(Exception):
+    def __init__(self, message, code=None, results=None):
+        Exception.__init__(self, message)
+        self.code = code
+        self.results = results
+
+# the eapiTransport talks json-rpc to the local eapi server over its unix socket and
+#  keeps the connection open between calls.  enable() and config() behave like the
+#  pyeapi node methods of the same name, each a single request with the enable (and
+#  configure) commands in front of the caller's.  a request that fails on the
+#  connection itself is retried on a fresh connection with a growing backoff, except
+#  a timed out config, which may already have been applied
+class eapiTransport:
+    def __init__(self, path, timeout=30, retries=2):
+        self.path = path
+        self.timeout = timeout
+        self.retries = retries
+        # the transport lives on one thread, so it keeps its own metrics for the event
+        #  loop to collect with takeMetrics rather than sharing the agent's
+        self.metrics = agentMetrics()
+        self.connection = None
+        self.requestId = 0
+        self.lastLatency = None
+
+    def enable(self, commands, autoComplete=False, encoding='json'):
+        commands = [commands] if isinstance(commands, str) else list(commands)
+        results = self.runCmds(['enable'], commands, encoding, autoComplete, idempotent=True)
+        return [{'command':command, 'result':result, 'encoding':encoding} for command, result in zip(commands, results)]
+
+    def config(self, commands, autoComplete=False):
+        commands = [commands] if isinstance(commands, str) else list(commands)
+        return self.runCmds(['enable', 'configure terminal'], commands, 'json', autoComplete, idempotent=False)
+
+    # run commands after the mode changing prefix in one request, and return the results
+    #  of the commands alone
+    def runCmds(self, prefix, commands, encoding, autoComplete, idempotent):
+        return self.request(prefix + commands, encoding, autoComplete, idempotent)[len(prefix):]
+
+    def request(self, cmds, encoding, autoComplete, idempotent):
+        self.requestId += 1
+        body = json.dumps({'jsonrpc':'2.0', 'method':'runCmds', 'id':self.requestId,
+                           'params':{'version':1, 'cmds':cmds, 'format':encoding, 'autoComplete':autoComplete}})
+
+        attempt = 0
+        while True:
+            start = time.monotonic()
+            try:
+                response = self.post(body)
+                break
+            except (OSError, http.client.HTTPException) as e:
+                self.close()
+                timedOut = isinstance(e, socket.timeout)
+                if attempt >= self.retries or (timedOut and not idempotent):
+                    raise
+                self.metrics.count('eapiRetries')
+                time.sleep(0.05 * 2 ** attempt)
+                attempt += 1
+            finally:
+                self.lastLatency = time.monotonic() - start
+                self.metrics.observe('eapiRequest', self.lastLatency)
+
+        if 'error' in response:
+            error = response['error']
+            raise eapiError(error.get('message', 'eapi error'), error.get('code'), error.get('data'))
+        return response['result']
+
+    def post(self, body):
+        if self.connection is None:
+            self.connection = unixHTTPConnection(self.path, self.timeout)
+        self.connection.request('POST', '/command-api', body, {'Content-Type':'application/json'})
+        reply = self.connection.getresponse()
+        data = reply.read()
+        if reply.status != 200:
+            raise eapiError("eapi returned http {} {}".format(reply.status, reply.reason), reply.status)
+        return json.loads(data)
+
+    def close(self):
+        if self.connection:
+            self.connection.close()
+            self.connection = None
+
+# hand over what an eapi connection has recorded since it was last asked and start it
+#  afresh.  pyeapi nodes record nothing
+def takeMetrics(node):
+    if not isinstance(node, eapiTransport):
+        return None
+    metrics, node.metrics = node.metrics, agentMetrics()
+    return metrics
+
+class unixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socketPath, timeout):
+        http.client.HTTPConnection.__init__(self, 'localhost', timeout=timeout)
+        self.socketPath = socketPath
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socketPath)
+
+# the configFetcher downloads remote configurations in process.  it remembers the
+#  etag and last-modified headers of the last good download so the server can answer
+#  304 when nothing changed, and keeps a copy of that download on flash so a restart
+#  can begin with it straight away
+class configFetcher:
+    def __init__(self, cacheFile):
+        self.cacheFile = cacheFile
+        self.metaFile = cacheFile + ".meta"
+        # the url whose contents are currently loaded, if any
+        self.loaded = None
+
+    def readMeta(self):
+        try:
+            with open(self.metaFile, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # the cached copy of url, or None if we don't have one
+    def cached(self, url):
+        if self.readMeta().get('url', None) != url:
+            return None
+        try:
+            with open(self.cacheFile, "r") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    # fetch url, from inside the vrf's network namespace if one is given.  returns
+    #  (contents, headers), or (None, None) if the server says our copy is current
+    def fetch(self, url, vrf=None, timeout=10):
+        request = urllib.request.Request(url)
+        meta = self.readMeta()
+        if self.loaded == url and meta.get('url', None) == url:
+            if meta.get('etag', None):
+                request.add_header('If-None-Match', meta['etag'])
+            if meta.get('lastModified', None):
+                request.add_header('If-Modified-Since', meta['lastModified'])
+
+        result = {}
+
+        def run():
+            try:
+                if vrf:
+                    enterNetns("ns-{}".format(vrf))
+                with urllib.request.urlopen(request, timeout=timeout) as response:
+                    charset = response.headers.get_content_charset() or 'utf-8'
+                    result['response'] = (response.read().decode(charset), response.headers)
+            except urllib.error.HTTPError as e:
+                if e.code == 304:
+                    result['response'] = (None, None)
+                else:
+                    result['error'] = e
+            except Exception as e:
+                result['error'] = e
+
+        # a network namespace is entered per thread, so the transfer gets a thread of its
+        #  own and the agent itself stays in the default namespace
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout * 2)
+
+        if 'error' in result:
+            raise result['error']
+        if 'response' not in result:
+            raise TimeoutError("timed out fetching {}".format(url))
+        return result['response']
+
+    # remember a download that parsed properly as the last good copy
+    def save(self, url, contents, headers):
+        meta = {'url':url, 'etag':headers.get('ETag', None), 'lastModified':headers.get('Last-Modified', None)}
+        try:
+            with open(self.cacheFile + ".tmp", "w") as f:
+                f.write(contents)
+            os.replace(self.cacheFile + ".tmp", self.cacheFile)
+            with open(self.metaFile, "w") as f:
+                json.dump(meta, f)
+        except OSError:
+            pass
+        self.loaded = url
+
+# move the calling thread into a named network namespace, the same thing ip netns exec
+#  does for a process
+def enterNetns(name):
+    fd = os.open("/var/run/netns/{}".format(name), os.O_RDONLY)
+    try:
+        if hasattr(os, 'setns'):
+            os.setns(fd, os.CLONE_NEWNET)
+        else:
+            libc = ctypes.CDLL(None, use_errno=True)
+            if libc.setns(fd, 0x40000000) != 0:
+                errno = ctypes.get_errno()
+                raise OSError(errno, os.strerror(errno))
+    finally:
+        os.close(fd)
+
+# the configuration and the rules compiled from it, along with the mac and lldp
+#  searches against them.  none of this needs the sdk, so the offline classify mode
+#  uses it on its own and InterfaceMonitor builds on it
+class configRules:
+    def __init__(self, tracer):
+        self.tracer = tracer
+        self.metrics = agentMetrics()
+        self.configs = {"configs":[], "macIndex":macRuleIndex([]), "lldpMatcher":lldpRuleMatcher([])}
+        # the last few parsed configurations, keyed on a hash of their contents
+        self.parsedConfigs = collections.OrderedDict()
+
+    # somewhere to publish load times.  the agent puts them in its status
+    def statusSet(self, name, value):
+        pass
+
+    # the fingerprints of the command plans eapi won't accept, with the error for each,
+    #  or None if they couldn't be checked.  without a switch there is nothing to check
+    #  them against
+    def validatePlans(self, plans):
+        return {}
+
+    # parsed configurations are remembered by a hash of their contents.  the same bytes
+    #  coming back (a vrf change, a config option set to the same thing, the cached copy
+    #  of a remote file) get the already normalized result back without any parsing
+    def parseConfig(self, fileHandle):
+        contents = fileHandle.read()
+        if isinstance(contents, bytes):
+            contents = contents.decode('utf-8')
+        contentHash = hashlib.sha256(contents.encode('utf-8')).hexdigest()
+
+        # a sidecar mac file that changed means parsing again even if the config didn't
+        cached = self.parsedConfigs.get(contentHash, None)
+        if cached and self.sidecarStats(stat[0] for stat in cached['sidecars']) == cached['sidecars']:
+            self.parsedConfigs.move_to_end(contentHash)
+            self.tracer.trace0("- configuration unchanged, using the already parsed copy")
+            return cached
+
+        start = time.monotonic()
+        result = self.loadConfig(contents)
+        parsed = time.monotonic()
+
+        if not isinstance(result, dict) or len(result['configs']) == 0:
+            self.tracer.trace0("Error loading the configuration")
+            raise Exception("Error loading the configuration")
+
+        # now we need to reformat all the macs, ouis, and lldpcaps to something consistent and usable
+        for config in result['configs']:
+            config['config']['macs'] = self.loadMacs(config['config'])
+            config['config']['ouis'] = list(map(formatMac, config['config'].get('ouis', [])))
+
+            if 'lldp' not in config['config']:
+                continue
+
+            config['config']['lldp']['caps'] = self.convertListOfCapsToInt(config['config'].get('lldp', {}).get('caps', None))
+
+            # convert any lldp descriptions to lower case
+            # not a huge fan of this loop
+            if 'descriptions' in config['config']['lldp']:
+                descriptions = []
+                for desc in config['config']['lldp']['descriptions']:
+                    descriptions.append(desc.lower())
+                config['config']['lldp']['descriptions'] = descriptions
+
+            # convert any lldp names to lower case
+            if 'names' in config['config']['lldp']:
+                config['config']['lldp']['names'] = [ name.lower() for name in config['config']['lldp']['names'] ]
+
+            # make sure to convert any mac like things in the lldp config section if it's there
+            for ar in ['macs', 'ouis']:
+                config['config']['lldp'][ar] = list(map(formatMac, config['config']['lldp'].get(ar, [])))
+
+            self.tracer.trace1("config: {} lldpCap: {}", config['config']['name'], config['config']['lldp']['caps'])
+
+        compileTime, validateTime, dropped, rejected = self.compilePlans(result)
+        if dropped:
+            self.tracer.trace0("- rejected {} configs with commands eapi would not accept", dropped)
+        self.statusSet("configCompileMs", "{:.1f}".format(compileTime * 1000))
+        self.statusSet("configValidateMs", "{:.1f}".format(validateTime * 1000))
+        self.statusSet("configRejected", str(dropped))
+        compiled = time.monotonic()
+
+        # compile all the macs and ouis into a single lookup table so searchMAC doesn't
+        #  need to walk every config for every learned mac
+        result['macIndex'] = macRuleIndex(result['configs'])
+        indexed = time.monotonic()
+        result['lldpMatcher'] = lldpRuleMatcher(result['configs'])
+        # configs by name for the profiles remembered across restarts.  a name used
+        #  more than once belongs to the first config with it
+        result['profiles'] = {}
+        for config in result['configs']:
+            if 'name' in config['config']:
+                result['profiles'].setdefault(config['config']['name'], config['config'])
+        # the decisions remembered under this config are only good for the same sidecar files too
+        result['sidecars'] = self.sidecarStats([config['config']['macsFile'] for config in result['configs'] if 'macsFile' in config['config']])
+        result['contentHash'] = contentHash if not result['sidecars'] else hashlib.sha256(
+            json.dumps([contentHash, result['sidecars']]).encode('utf-8')).hexdigest()
+        normalized = time.monotonic()
+
+        # only a configuration eapi took as a whole is kept.  one that couldn't be checked,
+        #  or had plans refused, is parsed and checked again on the next load
+        if rejected is not None and not rejected:
+            self.parsedConfigs[contentHash] = result
+            while len(self.parsedConfigs) > 4:
+                self.parsedConfigs.popitem(last=False)
+
+        self.tracer.trace0("- successfully loaded the config, parse {:.1f}ms normalize {:.1f}ms, compile {:.1f}ms validate {:.1f}ms",
+            (parsed - start) * 1000, (normalized - parsed - validateTime) * 1000, compileTime * 1000, validateTime * 1000)
+        self.statusSet("configParseMs", "{:.1f}".format((parsed - start) * 1000))
+        self.statusSet("configNormalizeMs", "{:.1f}".format((normalized - parsed) * 1000))
+        macs, resident, mapped = result['macIndex'].size()
+        maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.tracer.trace0("- {} macs in {} bytes, {} bytes mapped, loaded and indexed in {:.1f}ms, peak rss {}kB",
+            macs, resident, mapped, (indexed - compiled) * 1000, maxRss)
+        self.statusSet("configMacs", str(macs))
+        self.statusSet("configMacBytes", str(resident))
+        self.statusSet("configMacMappedBytes", str(mapped))
+        self.statusSet("configMacLoadMs", "{:.1f}".format((indexed - compiled) * 1000))
+        self.statusSet("maxRssKb", str(maxRss))
+
+        return result
+
+    # every state of every config, and of the default, becomes a command plan.  identical
+    #  blocks share one plan, and each distinct one is checked against eapi once.  a
+    #  config with any plan that fails is dropped from the ruleset, so its devices fall
+    #  through to the next match or the default, and the default loses the state that
+    #  failed.  returns the compile and validate times, the number of configs dropped and
+    #  the plans rejected, None if they couldn't be checked
+    def compilePlans(self, result):
+        start = time.monotonic()
+        plans = {}
+        default = result.get('default', None) or {}
+        for config in [default] + [config['config'] for config in result['configs']]:
+            states = config.get('states', {})
+            for state, commands in states.items():
+                fingerprint = tuple(commands)
+                if fingerprint not in plans:
+                    plans[fingerprint] = commandPlan(commands)
+                states[state] = plans[fingerprint]
+        compiled = time.monotonic()
+
+        rejected = self.validatePlans(list(plans.values()))
+        for fingerprint, error in (rejected or {}).items():
+            self.tracer.trace0("- rejecting {}: {}", list(fingerprint), error)
+        if not rejected:
+            return compiled - start, time.monotonic() - compiled, 0, rejected
+
+        states = default.get('states', {})
+        for state in [state for state, plan in states.items() if plan.fingerprint in rejected]:
+            del states[state]
+        configs = [config for config in result['configs']
+                   if not any(plan.fingerprint in rejected for plan in config['config'].get('states', {}).values())]
+        dropped = len(result['configs']) - len(configs)
+        result['configs'] = configs
+
+        return compiled - start, time.monotonic() - compiled, dropped, rejected
+
+    # the macs of a config as a sorted array of 48 bit integers, 8 bytes each instead of a
+    #  python string.  a macsFile adds a sidecar file to the ones listed in the config:
+    #  a .bin file of 8 byte native integers is mapped, anything else is read as text
+    #  with one mac a line
+    def loadMacs(self, config):
+        macs = array.array('Q', (key for key in (macToInt(formatMac(mac), 12) for mac in config.get('macs', [])) if key is not None))
+        path = config.get('macsFile', None)
+        if path is None:
+            return sortedMacs(macs)
+
+        if path.endswith('.bin'):
+            keys = mapMacs(path)
+            if not macs:
+                return keys
+            macs.extend(keys)
+        else:
+            macs.extend(readMacs(path))
+        self.tracer.trace1("- read {} macs for {} from {}", len(macs), config.get('name'), path)
+        return sortedMacs(macs)
+
+    # the size and modification time of each sidecar file, missing files as None
+    def sidecarStats(self, paths):
+        stats = []
+        for path in paths:
+            try:
+                stat = os.stat(path)
+                stats.append([path, stat.st_size, stat.st_mtime_ns])
+            except OSError:
+                stats.append([path, None, None])
+        return stats
+
+    # json is tried first when the document looks like json since the json parser is far
+    #  faster than yaml.  yaml uses the libyaml based loader when pyyaml was built with it
+    def loadConfig(self, contents):
+        if contents.lstrip().startswith('{'):
+            try:
+                return json.loads(contents)
+            except ValueError:
+                pass
+
+        try:
+            return yaml.load(contents, Loader=getattr(yaml, 'CSafeLoader', yaml.SafeLoader))
+        except:
+            # we failed loading yaml.  let's try json
+            try:
+                return json.loads(contents)
+            except:
+                return {"configs":[]}
+
+    # this function will convert the lldp system capabilities to an integer
+    #  bitmask, which is how it's stored.  unfortunately the sdk doesn't
+    #  give me a way to get at that integer so i need to handle it myself
+    #  the way this is written is likely fragile, but I don't see the python
+    #  SDK defining the enum so we need to trust the documentation and that
+    #  it'll never change
+    def convertLLDPCapsToInt(self, lldpCaps):
+        result = lldpCapsEnum.isOther
+        
+        if lldpCaps.repeater():
+            result |= lldpCapsEnum.isRepeater
+        if lldpCaps.bridge():
+            result |= lldpCapsEnum.isBridge
+        if lldpCaps.vlan_ap():
+            result |= lldpCapsEnum.isAP
+        if lldpCaps.router():
+            result |= lldpCapsEnum.isRouter
+        if lldpCaps.telephone():
+            result |= lldpCapsEnum.isTelephone
+        if lldpCaps.docsis():
+            result |= lldpCapsEnum.isDocsis
+        if lldpCaps.station():
+            result |= lldpCapsEnum.isStation
+
+        return result
+
+    # eapi reports the lldp capabilities as a dict of capability name to a bool
+    def convertCapsDictToInt(self, capsDict):
+        result = lldpCapsEnum.isOther
+        names = {'repeater':lldpCapsEnum.isRepeater, 'bridge':lldpCapsEnum.isBridge,
+                 'wlanAccessPoint':lldpCapsEnum.isAP, 'router':lldpCapsEnum.isRouter,
+                 'telephone':lldpCapsEnum.isTelephone, 'docsisCableDevice':lldpCapsEnum.isDocsis,
+                 'stationOnly':lldpCapsEnum.isStation}
+
+        for cap, enabled in capsDict.items():
+            if enabled:
+                result |= names.get(cap, lldpCapsEnum.isOther)
+
+        return result
+
+    # this function will convert the configuration file list of string lldp capabilites
+    #  to the integer form of them.  this function has the same caveats relating to the
+    #  SDK as the above function convertLLDPCapsToInt
+    def convertListOfCapsToInt(self, capsList):
+        if capsList == None:
+            return None
+
+        result = lldpCapsEnum.isOther
+
+        for cap in capsList:
+            if cap == "isRepeater":
+                result |= lldpCapsEnum.isRepeater
+            elif cap == "isBridge":
+                result |= lldpCapsEnum.isBridge
+            elif cap == "isAP":
+                result |= lldpCapsEnum.isAP
+            elif cap == "isRouter":
+                result |= lldpCapsEnum.isRouter
+            elif cap == "isTelephone":
+                result |= lldpCapsEnum.isTelephone
+            elif cap == "isDocsis":
+                result |= lldpCapsEnum.isDocsis
+            elif cap == "isStation":
+                result |= lldpCapsEnum.isStation
+
+        return result
+
+    def searchLLDP(self, lldpCaps, mac, remoteDescription, remoteSystem):
+        # the checks themselves are compiled into the lldp matcher when the config
+        #  is loaded.  a config matches when none of the checks it needed came back
+        #  False, and the first matching config in the file wins
+
+        if lldpCaps:
+            lldpCaps = self.convertLLDPCapsToInt(lldpCaps)
+        return self.matchLLDP(lldpCaps, mac, remoteDescription, remoteSystem)
+
+    # the lldp search once the capabilities are in their integer form
+    def matchLLDP(self, lldpCaps, mac, remoteDescription, remoteSystem):
+        self.tracer.trace1("searching for an lldp based match")
+        start = time.perf_counter()
+        result = self.configs['lldpMatcher'].match(lldpCaps, mac, remoteDescription, remoteSystem)
+        self.metrics.observe('lldpLookup', time.perf_counter() - start)
+        self.metrics.count('lldpMatches' if result else 'lldpMisses')
+        self.tracer.trace0("caps: {}, mac: {}, match: {}", lldpCaps, mac, result.get('name') if result else None)
+
+        return result
+
+    # the searchMAC() function will look the mac up in the compiled index which
+    #  holds both the exact matches and the oui matches, then finally fall back to
+    #  the default, returning the configurations in that order, or None if there
+    #  is no default
+    def searchMAC(self, mac):
+        self.tracer.trace1("searching for {}", mac)
+        start = time.perf_counter()
+        result = self.configs['macIndex'].lookup(mac)
+        self.metrics.observe('macLookup', time.perf_counter() - start)
+
+        if result:
+            self.tracer.trace0("we found a match in {}", result.get('name'))
+            self.metrics.count('macMatches')
+            return result
+        else:
+            # we didn't find any mac or oui match.  if there is a default, let's use it
+            self.tracer.trace0("we didn't find a match in any config")
+            result = self.configs.get('default', None)
+            self.metrics.count('macDefaults' if result else 'macMisses')
+            return result
+
+# the configRules the reload thread loads new configurations with.  traces and status
+#  are held and handed back to the event loop with the result, and the command plans
+#  are validated over a connection of the reload's own
+class configLoader(configRules):
+    def __init__(self, connect):
+        configRules.__init__(self, heldTracer())
+        self.status = []
+        self.connect = connect
+        # a monitored interface to check plans on, None when there isn't one
+        self.validateIntf = None
+
+    def statusSet(self, name, value):
+        self.status.append((name, value))
+
+    # run one load, returning the configuration it produced (None if there is nothing
+    #  new) along with the traces, status and metrics it left behind
+    def run(self, intfStr, load, *args):
+        self.tracer, self.status, self.metrics = heldTracer(), [], agentMetrics()
+        self.validateIntf = intfStr
+        try:
+            result = load(*args)
+        except Exception as e:
+            self.tracer.trace0("Could not load the configuration: {}", e)
+            result = None
+        return result, self.tracer, self.status, self.metrics
+
+    # order of precedence on config file type will be
+    #   json formatted embedded string
+    #   local file either json or yaml formatted
+    #   remote file either json or yaml formatted
+    # we'll break at the first success
+    def loadOption(self, value, fetcher, vrf, timeout):
+        # try the config as a string
+        try:
+            self.tracer.trace0("Attempting embedded string")
+            result = self.parseConfig(io.StringIO(value))
+        except:
+            pass
+        else:
+            # there was no exception, it must have parsed. we're done here
+            self.tracer.trace0("Parsed an embedded string configuration")
+            fetcher.loaded = None
+            return result
+
+        # try loading the local file
+        try:
+            self.tracer.trace0("Attempting a local configuration file")
+            with open(value, "r") as configFile:
+                result = self.parseConfig(configFile)
+        except:
+            pass
+        else:
+            # the file parsing worked.  we're done here
+            self.tracer.trace0("Parsed a local filesystem configuration")
+            fetcher.loaded = None
+            return result
+
+        try:
+            self.tracer.trace0("Attempting a remote configuration file")
+            outputStr, headers = fetcher.fetch(value, vrf, timeout)
+            if outputStr is None:
+                self.tracer.trace0("The remote configuration has not changed")
+                return None
+            result = self.parseConfig(io.StringIO(outputStr))
+            fetcher.save(value, outputStr, headers)
+        except Exception as e:
+            self.tracer.trace0("Could not fetch the remote configuration: {}", e)
+            if fetcher.loaded == value:
+                self.tracer.trace0("Continuing with the cached remote configuration")
+                return None
+        else:
+            # the remote file parse worked.  we're done here
+            self.tracer.trace0("Parsed a remote file configuration")
+            return result
+
+        self.tracer.trace0("Could not parse any configuration information!")
+        return None
+
+    # if we have a cached copy of a remote configuration and haven't loaded anything from
+    #  it yet, start from the cache so we aren't left waiting on a slow or unreachable server
+    def loadCached(self, value, fetcher):
+        if fetcher.loaded == value:
+            return None
+        cached = fetcher.cached(value)
+        if not cached:
+            return None
+
+        try:
+            result = self.parseConfig(io.StringIO(cached))
+        except Exception:
+            return None
+        fetcher.loaded = value
+        self.tracer.trace0("Parsed the cached copy of the remote configuration")
+        return result
+
+    # check the plans in a config session that is aborted rather than committed, on a
+    #  monitored interface.  all of them go in one session, and only if that is refused
+    #  does each get a session of its own to find the ones at fault, once the interface
+    #  itself is known to be accepted.  with no interface to check on, or if eapi can't
+    #  be reached, the plans are taken as they are
+    def validatePlans(self, plans):
+        if not plans:
+            return {}
+        if self.validateIntf is None:
+            self.tracer.trace0("no monitored interface to validate the configuration on")
+            return None
+        try:
+            node = self.connect()
+        except Exception as e:
+            self.tracer.trace0("could not validate the configuration: {}", e)
+            return None
+
+        rejected = {}
+        try:
+            for group in [plans] + ([[plan] for plan in plans] if len(plans) > 1 else []):
+                try:
+                    configSession(node, [command for plan in group for command in plan.render(self.validateIntf)], 'abort')
+                except Exception as e:
+                    if not commandRefused(e):
+                        # what was found refused before eapi went away still is, but with
+                        #  nothing found the plans weren't checked at all
+                        self.tracer.trace0("could not validate the configuration: {}", e)
+                        return rejected or None
+                    if group is plans and not self.validateOn(node):
+                        return None
+                    if len(group) == 1:
+                        rejected[group[0].fingerprint] = e
+                else:
+                    if len(group) > 1:
+                        return rejected
+            return rejected
+        finally:
+            if isinstance(node, eapiTransport):
+                self.metrics.merge(takeMetrics(node))
+                node.close()
+
+    # whether an empty plan goes through on the interface plans are checked on.  if not,
+    #  a refusal says nothing about the plans
+    def validateOn(self, node):
+        try:
+            configSession(node, commandPlan([]).render(self.validateIntf), 'abort')
+        except Exception as e:
+            self.tracer.trace0("could not validate the configuration on {}: {}", self.validateIntf, e)
+            return False
+        return True
+
+# run commands in a new config session ended by commit (or abort).  if anything fails
+#  the session is thrown away before the exception is passed on
+def configSession(node, commands, end):
+    sessionID = uuid.uuid1()
+    try:
+        node.config(['configure session {}'.format(sessionID)] + commands + [end], autoComplete=True)
+    except:
+        try:
+            node.config(['no configure session {}'.format(sessionID)])
+        except:
+            pass
+        raise
+
+sdkHandlers = (eossdk.AgentHandler, eossdk.IntfHandler, eossdk.MacTableHandler, eossdk.LldpHandler,
+               eossdk.TimeoutHandler, eossdk.FdHandler) if eossdk else ()
+
 # our monitor inherits from the
 #  interface handler in order to subscribe to intf up/down events
 #  the mac table handler in order to subscribe to mac learn events
-class InterfaceMonitor(eossdk.AgentHandler, eossdk.IntfHandler, eossdk.MacTableHandler, eossdk.LldpHandler):
-    def __init__(self, intfMgr, agentMgr, macMgr, lldpMgr):
+class InterfaceMonitor(configRules, *sdkHandlers):
+    def __init__(self, intfMgr, agentMgr, macMgr, lldpMgr, timeoutMgr):
+        configRules.__init__(self, lazyTracer("autoPortConfigAgent"))
         eossdk.AgentHandler.__init__(self, agentMgr)
         eossdk.IntfHandler.__init__(self, intfMgr)
         eossdk.MacTableHandler.__init__(self, macMgr)
         eossdk.LldpHandler.__init__(self, lldpMgr)
-        self.tracer = eossdk.Tracer("autoPortConfigAgent")
+        eossdk.TimeoutHandler.__init__(self, timeoutMgr)
+        eossdk.FdHandler.__init__(self)
         self.intfMgr_ = intfMgr
         self.agentMgr_ = agentMgr
         self.macTableMgr_ = macMgr
         self.lldpMgr = lldpMgr
-        self.pyeapi = pyeapi.connect_to("localhost")
-        # this list keeps track of which interfaces have received a linkup event
-        #  and which we are still interested in mac events for as we have not yet
-        #  learned anything to configure on.
-        self.macInterfaces = []
-        # this list keeps track of interfaces we are watching for lldp learns
-        self.lldpInterfaces = []
-        # this list keeps track of the interfaces we are currently configured to
-        #  monitor for linkup/linkdown messages.
-        self.monitoredInterfaces = []
-
-        self.configs = {"configs":[]}
+        # eapi goes over the unix socket when the switch has it turned on, otherwise
+        #  through pyeapi
+        self.eapiSocket = "/var/run/command-api.sock"
+        self.eapiTimeout = 30.0
+        self.eapiRetries = 2
+        self.pyeapi = self.connectEapi()
+        # the state of every interface we are currently configured to monitor for
+        #  linkup/linkdown messages, keyed on the interface name.  macWaiting holds the
+        #  ones still waiting on a mac learn keyed on their IntfId hash, so we know when
+        #  to watch the mac table and can throw away learns on every other port cheaply
+        self.intfStates = {}
+        self.macWaiting = {}
+        self.lldpWaiting = {}
+        # what each lldp neighbor was classified onto, by the sdk's hash of the neighbor
+        #  (its interface and remote system index), along with the configVersion it was
+        #  decided under and what it advertised.  a neighbor is dropped from here when
+        #  lldp removes it
+        self.lldpNeighbors = collections.OrderedDict()
+
         self.vrf = None
         self.enableLLDP = True
-
+        self.fetcher = configFetcher("/mnt/flash/autoPortConfigAgent.cache")
+        self.fetchTimeout = 10
+
+        # configurations are loaded by the loader on a thread of their own.  configVersion
+        #  counts the rulesets swapped in, 0 until the first one is
+        self.loader = configLoader(self.connectEapi)
+        self.reloads = None
+        self.configVersion = 0
+        self.refreshInterval = 0
+        # plans are checked on a monitored interface, so a load asked for before the
+        #  first interface list is in waits in deferredConfig
+        self.interfacesKnown = False
+        self.deferredConfig = None
+
+        # interface configurations waiting to be sent, keyed on the interface, and the
+        #  named timers sharing the sdk timeout.  inFlight holds the interfaces with a
+        #  commit on its way, maxOpsPerSecond limits the eapi operations sent
+        self.batchWindow = 0
+        self.pendingConfigs = collections.OrderedDict()
+        self.timers = {}
+        self.inFlight = set()
+        self.maxOpsPerSecond = 0
+        self.opTokens = 0
+        self.opTokensAt = 0
+
+        # the (profile, commands) we last applied to each interface, used to skip
+        #  sessions that wouldn't change anything
+        self.appliedConfigs = {}
+        self.verifyApplied = False
+
+        # the hot path metrics are published to the agent status every metricsInterval
+        #  seconds and optionally written to metricsFile
+        self.metricsInterval = 30
+        self.metricsFile = None
+        self.recorder = decisionRecorder()
+
+        # the profiles devices were classified onto, kept across restarts.  what the
+        #  lookups change is written to flash every decisionFlushInterval seconds
+        self.knownDevices = decisionStore("/mnt/flash/autoPortConfigAgent.decisions")
+        self.decisionFlushInterval = 5
+
+        # when asyncWorkers is set eapi calls run on this pool instead of inline.  pools
+        #  that were replaced stay around until their last job has come back
+        self.workers = None
+        self.retiredWorkers = []
+        self.interfacesGeneration = 0
+
+        # ports that are already up when they start being monitored are classified from
+        #  the current mac table and lldp neighbors rather than waiting for them to flap.
+        #  holdConfigs keeps configureInterface from flushing while a sweep queues them
+        self.reconcileOnStart = True
+        self.initialized = False
+        self.holdConfigs = False
 
     # the on_agent_option function is a standard callback called when an option is
     #  set in the configuration.  it can be called after agent startup if the user
@@ -60,15 +1438,34 @@ class InterfaceMonitor(eossdk.AgentHandler, eossdk.IntfHandler, eossdk.MacTableH
             else:
                 self.enableLLDP = False
 
-        elif optionName == "interfaces":
-            # turn off any monitoring that's already on
-            self.tracer.trace5("Disabling all interface monitoring")
-            self.watch_all_intfs(False)
-            self.watch_all_mac_entries(False)
-            self.macInterfaces = []
-            self.lldpInterfaces = []
-            self.monitoredInterfaces = []
+        # how long, in milliseconds, to hold interface configurations so they can share
+        #  a single config session.  0 or unset applies each one as it comes in
+        elif optionName == "batchWindow":
+            try:
+                self.batchWindow = max(float(value), 0) / 1000 if value else 0
+            except ValueError:
+                self.tracer.trace0("Invalid batchWindow {}, disabling batching", value)
+                self.batchWindow = 0
+
+            if self.batchWindow <= 0:
+                self.timers.pop('batch', None)
+                self.flushPendingConfigs()
+
+        # the most eapi operations (a commit, or a batch of them) sent per second, so a mass
+        #  event can't swamp the config subsystem.  0 or unset doesn't limit them
+        elif optionName == "maxOpsPerSecond":
+            try:
+                self.maxOpsPerSecond = max(float(value), 0) if value else 0
+            except ValueError:
+                self.tracer.trace0("Invalid maxOpsPerSecond {}, not limiting eapi operations", value)
+                self.maxOpsPerSecond = 0
+            self.opTokens = max(self.maxOpsPerSecond, 1)
+            self.opTokensAt = eossdk.now()
 
+            self.timers.pop('rate', None)
+            self.flushPendingConfigs()
+
+        elif optionName == "interfaces":
             if value in ("", "all"):
                 value = ""
                 self.tracer.trace0("No specific interfaces have been set to be monitored!, monitoring everything")
@@ -77,23 +1474,127 @@ class InterfaceMonitor(eossdk.AgentHandler, eossdk.IntfHandler, eossdk.MacTableH
             #  first, use pyeapi to pull the interface names
             #  of the requisite interfaces. "all" or "" will
             #  not limit the interfaces we are looking at
-            t = []
             cmd = 'show int {} stat'.format(value)
+            self.interfacesGeneration += 1
+            generation = self.interfacesGeneration
+            start = time.monotonic()
+
+            def interfacesFetched(t, error):
+                if error:
+                    self.tracer.trace0("Could not fetch the interface list properly.  Is management api configured?")
+                    self.releaseConfig()
+                    return
+                if generation != self.interfacesGeneration:
+                    # the option changed again while we were waiting on eapi
+                    return
+
+                if len(t) > 0:
+                    self.interfaces = t[0].get('result', []).get('interfaceStatuses',[])
+                    self.updateMonitoredInterfaces(self.interfaces, start)
+                self.releaseConfig()
+
+            self.runEapi('interfaces', lambda node: node.enable(cmd, autoComplete=True), interfacesFetched)
+
+            # once the config is loaded any newly monitored ports that are already up can
+            #  be classified straight away.  on startup on_initialized does this itself
+            if self.initialized:
+                self.reconcile()
+
+        # where the known devices are kept and how many of them.  "none" doesn't keep any
+        elif optionName in ("decisionStore", "decisionStoreSize"):
+            path = self.agentMgr_.agent_option("decisionStore") or "/mnt/flash/autoPortConfigAgent.decisions"
             try:
-                t = self.pyeapi.enable(cmd, autoComplete=True)
-            except:
-                self.tracer.trace0("Could not fetch the interface list properly.  Is management api configured?")
-                pass
+                size = max(int(self.agentMgr_.agent_option("decisionStoreSize") or 10000), 1)
+            except ValueError:
+                self.tracer.trace0("Invalid decisionStoreSize, keeping 10000 devices")
+                size = 10000
 
-            if len(t) > 0:
-                self.interfaces = t[0].get('result', []).get('interfaceStatuses',[])
-                # loop over any interfaces that we get back from pyeapi
-                #   and start the operstatus monitoring for each
-                for intf in self.interfaces:
-                    # grab a handle for this interface from eossdk
-                    self.tracer.trace1("monitoring interface {}".format(intf))
-                    self.watch_intf(eossdk.IntfId(intf), True)
-                    self.monitoredInterfaces.append(intf)
+            if self.knownDevices:
+                self.knownDevices.close()
+            self.knownDevices = decisionStore(path, size) if path.lower() != "none" else None
+
+        # classify ports that are already up when the agent starts.  on by default
+        elif optionName == "reconcileOnStart":
+            self.reconcileOnStart = not value or value.lower() != "false"
+
+        # how often, in seconds, the metrics are published.  0 turns publishing off
+        elif optionName == "metricsInterval":
+            try:
+                self.metricsInterval = float(value) if value else 30
+            except ValueError:
+                self.tracer.trace0("Invalid metricsInterval {}, using 30 seconds", value)
+                self.metricsInterval = 30
+
+            self.timers.pop('metrics', None)
+            if self.metricsInterval > 0:
+                self.setTimer('metrics', self.metricsInterval, self.publishMetrics)
+
+        elif optionName == "metricsFile":
+            self.metricsFile = value or None
+
+        # the number of recent decisions kept in memory, and a path to dump them to.
+        #  setting dumpDecisions writes the ring out straight away
+        elif optionName == "recorderSize":
+            try:
+                size = int(value) if value else 1000
+            except ValueError:
+                self.tracer.trace0("Invalid recorderSize {}, keeping 1000 decisions", value)
+                size = 1000
+            recorder = decisionRecorder(size)
+            recorder.decisions.extend(self.recorder.decisions)
+            self.recorder = recorder
+
+        elif optionName == "dumpDecisions":
+            if value:
+                self.dumpDecisions(value)
+
+        # check the running config of an interface before committing to it, rather
+        #  than trusting what we remember applying
+        elif optionName == "verifyApplied":
+            self.verifyApplied = bool(value) and value.lower() == "true"
+
+        # the number of background threads used for eapi calls.  0 or unset runs them
+        #  inline in the sdk callbacks
+        elif optionName == "asyncWorkers":
+            try:
+                workers = max(int(value), 0) if value else 0
+            except ValueError:
+                self.tracer.trace0("Invalid asyncWorkers {}, running eapi calls inline", value)
+                workers = 0
+
+            if self.workers and len(self.workers.queues) == workers:
+                return
+            self.startWorkers(workers)
+
+        # the local eapi unix socket, the seconds to wait on a request and how many times
+        #  a request that failed on the connection is retried
+        elif optionName in ("eapiSocket", "eapiTimeout", "eapiRetries"):
+            defaults = {"eapiSocket":"/var/run/command-api.sock", "eapiTimeout":30.0, "eapiRetries":2}
+            try:
+                setting = type(defaults[optionName])(value) if value else defaults[optionName]
+            except ValueError:
+                self.tracer.trace0("Invalid {} {}, using {}", optionName, value, defaults[optionName])
+                setting = defaults[optionName]
+            if setting == getattr(self, optionName):
+                return
+            setattr(self, optionName, setting)
+
+            # new connections for the event loop and for every worker
+            self.pyeapi = self.connectEapi()
+            if self.workers:
+                self.startWorkers(len(self.workers.queues))
+
+        # where the last good copy of a remote configuration is kept, and how long to
+        #  wait on the server.  both need to be set before the config option is loaded
+        elif optionName == "configCache":
+            self.fetcher = configFetcher(value or "/mnt/flash/autoPortConfigAgent.cache")
+
+        elif optionName == "fetchTimeout":
+            try:
+                self.fetchTimeout = float(value) if value else 10
+            except ValueError:
+                self.tracer.trace0("Invalid fetchTimeout {}, using 10 seconds", value)
+                self.fetchTimeout = 10
 
         # we may need to use a vrf on the configuration
         elif optionName == "vrf":
@@ -106,110 +1607,31 @@ class InterfaceMonitor(eossdk.AgentHandler, eossdk.IntfHandler, eossdk.MacTableH
             configStr = self.agentMgr_.agent_option("config")
             self.on_agent_option("config", configStr)
 
-        # order of precedence on config file type will be
-        #   json formatted embedded string
-        #   local file either json or yaml formatted
-        #   remote file either json or yaml formatted
-        # we'll break at the first success
+        # the configuration is loaded on the reload thread, see reloadConfig()
         elif optionName == "config":
             # if the config option is being unset, we really want to noop that
             if value:
-                # try the config as a string
                 self.tracer.trace6(value)
-                try:
-                    self.tracer.trace0("Attempting embedded string")
-                    configFile = io.StringIO(value)
-                    self.configs = self.parseConfig(configFile)
-                except:
-                    pass
-                else:
-                    # there was no exception, it must have parsed. we're done here
-                    self.tracer.trace0("Parsed an embedded string configuration")
-                    return
-
-                # try loading the local file
-                try:
-                    self.tracer.trace0("Attempting a local configuration file")
-                    configFile = open(value, "r")
-                    self.configs = self.parseConfig(configFile)
-                except:
-                    pass
-                else:
-                    # the file parsing worked.  we're done here
-                    self.tracer.trace0("Parsed a local filesystem configuration")
-                    return
-
-                # try loading a remote file
-                try:
-                    self.tracer.trace0("Attempting a remote configuration file")
-                    vrfCMDs = []
-                    if self.vrf:
-                        vrfCMDs = ["ip", "netns", "exec", f"ns-{self.vrf}"]
-
-                    outputStr = subprocess.run(vrfCMDs + ["wget", "-qO", "-", value], text=True, stdout=subprocess.PIPE).stdout
-                    configFile = io.StringIO(outputStr)
-                    self.configs = self.parseConfig(configFile)
-                except Exception as e:
-                    print(e)
-                    pass
-                else:
-                    # the remote file parse worked.  we're done here
-                    self.tracer.trace0("Parsed a remote file configuration")
-                    return
-
-                self.tracer.trace0("Could not parse any configuration information!")
-
-    def parseConfig(self, fileHandle):
-        result = {"configs":[]}
+                self.reloadConfig(value)
 
-        try:
-            result = yaml.safe_load(fileHandle)
-        except:
-            # we failed loading yaml.  let's try json
+        # how often, in seconds, to load the configuration again to pick up changes to a
+        #  remote or local file.  0 or unset only loads it when an option changes
+        elif optionName == "refreshInterval":
             try:
-                fileHandle.seek(0)
-                result = json.load(fileHandle)
-            except:
-                pass
-
-        if not isinstance(result, dict) or len(result['configs']) == 0:
-            self.tracer.trace0("Error loading the configuration")
-            raise Exception("Error loading the configuration")
-
-        # now we need to reformat all the macs, ouis, and lldpcaps to something consistent and usable
-        for config in result['configs']:
-            for ar in ['macs', 'ouis']:
-                config['config'][ar] = list(map(formatMac, config['config'].get(ar, [])))
+                self.refreshInterval = max(float(value), 0) if value else 0
+            except ValueError:
+                self.tracer.trace0("Invalid refreshInterval {}, not refreshing the configuration", value)
+                self.refreshInterval = 0
 
-            if 'lldp' not in config['config']:
-                continue
-
-            config['config']['lldp']['caps'] = self.convertListOfCapsToInt(config['config'].get('lldp', {}).get('caps', None))
-
-            # convert any lldp descriptions to lower case
-            # not a huge fan of this loop
-            if 'descriptions' in config['config']['lldp']:
-                descriptions = []
-                for desc in config['config']['lldp']['descriptions']:
-                    descriptions.append(desc.lower())
-                config['config']['lldp']['descriptions'] = descriptions
-
-            # convert any lldp names to lower case
-            if 'names' in config['config']['lldp']:
-                config['config']['lldp']['names'] = [ name.lower() for name in config['config']['lldp']['names'] ]
-
-            # make sure to convert any mac like things in the lldp config section if it's there
-            for ar in ['macs', 'ouis']:
-                config['config']['lldp'][ar] = list(map(formatMac, config['config']['lldp'].get(ar, [])))
-
-            self.tracer.trace1("config: {} lldpCap: {}".format(config['config']['name'], config['config']['lldp']['caps']))
-
-        self.tracer.trace0("- successfully loaded the config")
-
-        return result
+            self.timers.pop('refresh', None)
+            if self.refreshInterval > 0:
+                self.setTimer('refresh', self.refreshInterval, self.refreshConfig)
 
     def on_initialized(self):
         """ Callback provided by AgentHandler when all state is synchronized """
+        for option in ("eapiSocket", "eapiTimeout", "eapiRetries", "asyncWorkers"):
+            self.on_agent_option(option, self.agentMgr_.agent_option(option))
+
         # by default eossdk doesn't parse the options on load.  we need
         #  to fake the call this will return the option interfaces which
         #  we'll use to determine what to watch.  "all" or "" needs to
@@ -218,6 +1640,9 @@ class InterfaceMonitor(eossdk.AgentHandler, eossdk.IntfHandler, eossdk.MacTableH
         intfs = self.agentMgr_.agent_option("interfaces")
         self.on_agent_option("interfaces", intfs)
 
+        for option in ("configCache", "fetchTimeout"):
+            self.on_agent_option(option, self.agentMgr_.agent_option(option))
+
         vrfStr = self.agentMgr_.agent_option("vrf")
         if vrfStr:
             self.on_agent_option("vrf", vrfStr)
@@ -228,8 +1653,25 @@ class InterfaceMonitor(eossdk.AgentHandler, eossdk.IntfHandler, eossdk.MacTableH
         lldp = self.agentMgr_.agent_option("enableLLDP")
         self.on_agent_option("enableLLDP", lldp)
 
+        self.on_agent_option("refreshInterval", self.agentMgr_.agent_option("refreshInterval"))
+
+        for option in ("batchWindow", "maxOpsPerSecond"):
+            self.on_agent_option(option, self.agentMgr_.agent_option(option))
+
+        verify = self.agentMgr_.agent_option("verifyApplied")
+        self.on_agent_option("verifyApplied", verify)
+
+        for option in ("metricsFile", "metricsInterval", "recorderSize"):
+            self.on_agent_option(option, self.agentMgr_.agent_option(option))
+
+        self.on_agent_option("decisionStore", self.agentMgr_.agent_option("decisionStore"))
+
+        reconcile = self.agentMgr_.agent_option("reconcileOnStart")
+        self.on_agent_option("reconcileOnStart", reconcile)
+        self.initialized = True
+        self.reconcile()
+
         self.tracer.trace0("Fully initialized, running")
-        self.tracer.trace5("full config: {}".format(self.configs))
 
     def on_oper_status(self, intfId, operState):
         """ Callback provided by IntfHandler when an interface's
@@ -239,325 +1681,971 @@ class InterfaceMonitor(eossdk.AgentHandler, eossdk.IntfHandler, eossdk.MacTableH
         #  unfortunately with the sdk there is no way to filter the alerts based on interface
         #  so we will get a lot of mac address notices, potentially including for interfaces
         #  we have already processed and don't want to process again.
+        start = time.perf_counter()
         intfStr = intfId.to_string()
 
-        self.tracer.trace0("on_oper_status for {}".format(intfStr))
+        self.tracer.trace0("on_oper_status for {}", intfStr)
 
-        if intfStr not in self.monitoredInterfaces:
-            self.tracer.trace0(f" - skipping {intfStr} as it's not being monitored")
+        self.metrics.count('operStatusEvents')
+        intf = self.intfStates.get(intfStr, None)
+        if not intf:
+            self.tracer.trace0(" - skipping {} as it's not being monitored", intfStr)
+            self.metrics.count('operStatusDropped')
             return
 
         if operState == eossdk.INTF_OPER_UP:
             # if we have a default linkup event type, let's set the port and let the rest of the
             #   logic take over from there
+            profile = None
             portConfig = self.configs.get('default', [])
             if 'states' in portConfig and 'linkup' in portConfig['states']:
-                defaultCommands = portConfig['states']['linkup']
-                sessionID = uuid.uuid1()
-                commandSequence = ['configure session {}'.format(sessionID),
-                        'default interface {}'.format(intfStr),
-                        'interface {}'.format(intfStr) ] +defaultCommands + ['commit']
-                self.tracer.trace0("Defaulting interface {}".format(intfStr))
-                self.pyeapi.config(commandSequence, autoComplete=True)
-                
-            # searching the list should probably be a really quick loop as there aren't likely
-            #   to be a lot of interfaces in the coming up state at the same time
+                self.tracer.trace0("Defaulting interface {}", intfStr)
+                self.configureInterface(intfStr, portConfig['states']['linkup'], 'default')
+                profile = 'default'
+
             self.enableInterface(intfStr, mac=True, lldp=self.enableLLDP)
+            self.recorder.record(intfStr, 'linkup', None, profile, time.perf_counter() - start)
 
         # only act if the interface is admin enabled, to avoid overriding "shutdown" command
         elif operState == eossdk.INTF_OPER_DOWN and self.intfMgr_.admin_enabled(intfId):
-            # set the default and remove this interface from the list.  if it's the last one,
-            #  turn off mac table monitoring.  remove will except... is this better than a try
-            #  block?
-            self.disableInterface(intfStr, mac=True, lldp=True)
+            # stop waiting on anything for this interface.  if it was the last one waiting
+            #  on a mac, mac table monitoring gets turned off
+            self.setIntfState(intf, intfStateEnum.isIdle)
 
             # set the interface to a default if one exists
+            profile = None
             portConfig = self.configs.get('default', [])
             if 'states' in portConfig and 'linkdown' in portConfig['states']:
-                defaultCommands = portConfig['states']['linkdown']
-                sessionID = uuid.uuid1()
-                commandSequence = ['configure session {}'.format(sessionID),
-                        'default interface {}'.format(intfStr),
-                        'interface {}'.format(intfStr) ] +defaultCommands + ['commit']
-                self.tracer.trace0("Defaulting interface {}".format(intfStr))
-                self.pyeapi.config(commandSequence, autoComplete=True)
+                self.tracer.trace0("Defaulting interface {}", intfStr)
+                self.configureInterface(intfStr, portConfig['states']['linkdown'], 'default')
+                profile = 'default'
+
+            self.recorder.record(intfStr, 'linkdown', None, profile, time.perf_counter() - start)
+
+    # only the interfaces that were added to or removed from the monitored set are
+    #  watched or unwatched.  everything else keeps its state, including any mac or
+    #  lldp wait that is in progress
+    def updateMonitoredInterfaces(self, interfaces, start):
+        removed = [intf for intf in self.intfStates if intf not in interfaces]
+        added = [intf for intf in interfaces if intf not in self.intfStates]
+
+        for intf in removed:
+            self.tracer.trace1("no longer monitoring interface {}", intf)
+            # going idle first makes sure a pending mac wait is counted off
+            self.setIntfState(self.intfStates[intf], intfStateEnum.isIdle)
+            self.watch_intf(eossdk.IntfId(intf), False)
+            del self.intfStates[intf]
+            # nothing still queued for it goes out either
+            self.appliedConfigs.pop(intf, None)
+            self.pendingConfigs.pop(intf, None)
+
+        # loop over any new interfaces and start the operstatus monitoring for each
+        for intf in added:
+            # grab a handle for this interface from eossdk
+            self.tracer.trace1("monitoring interface {}", intf)
+            self.watch_intf(eossdk.IntfId(intf), True)
+            self.intfStates[intf] = intfState(intf)
+
+        elapsed = (time.monotonic() - start) * 1000
+        self.tracer.trace0("monitoring {} interfaces, {} added, {} removed in {:.1f}ms",
+            len(self.intfStates), len(added), len(removed), elapsed)
+        self.agentMgr_.status_set("interfacesReconfigMs", "{:.1f}".format(elapsed))
 
     # this function will handle enabling interface monitoring and setting
     #  up the sdk as needed
     def enableInterface(self, intfStr, mac=False, lldp=False):
         self.tracer.trace5("enableInterface")
-        if mac:
-            if intfStr not in self.macInterfaces:
-                self.tracer.trace2("enabling {} for mac learning".format(intfStr))
-                self.macInterfaces.append(intfStr)
+        intf = self.intfStates.get(intfStr, None)
+        if not intf:
+            return
 
-            # this call should be a noop if it's already on, but start monitoring for mac
-            #   learns in the mac table
-            self.watch_all_mac_entries(True)
+        state = intf.state & (intfStateEnum.isWaitingMac | intfStateEnum.isWaitingLLDP)
+        if mac:
+            self.tracer.trace2("enabling {} for mac learning", intfStr)
+            state |= intfStateEnum.isWaitingMac
         if lldp:
-            if intfStr not in self.lldpInterfaces:
-                self.tracer.trace2("enabling {} for lldp learning".format(intfStr))
-                self.lldpInterfaces.append(intfStr)
+            self.tracer.trace2("enabling {} for lldp learning", intfStr)
+            state |= intfStateEnum.isWaitingLLDP
+        self.setIntfState(intf, state)
 
     # this function will handle disabling interface monitoring and resetting
-    #  anything in the sdk to clean up as needed
+    #  anything in the sdk to clean up as needed.  once an interface isn't waiting
+    #  on anything it is settled until the caller says otherwise
     def disableInterface(self, intfStr, mac=False, lldp=False):
-        if mac:
-            if intfStr in self.macInterfaces:
-                self.macInterfaces.remove(intfStr)
+        intf = self.intfStates.get(intfStr, None)
+        if not intf or not intf.state & (intfStateEnum.isWaitingMac | intfStateEnum.isWaitingLLDP):
+            return
 
-                if len(self.macInterfaces) == 0:
-                    self.watch_all_mac_entries(False)
+        state = intf.state
+        if mac:
+            state &= ~intfStateEnum.isWaitingMac
         if lldp:
-            if intfStr in self.lldpInterfaces:
-                self.lldpInterfaces.remove(intfStr)
+            state &= ~intfStateEnum.isWaitingLLDP
+        self.setIntfState(intf, state or intfStateEnum.isSettled)
+
+    # move an interface to a new state.  this is the only place that keeps track of the
+    #  interfaces waiting on a mac or an lldp neighbor, so mac table monitoring is turned
+    #  on for the first one and off again after the last one without looking at any
+    #  other interface.  hashes can collide so each key holds a list
+    def setIntfState(self, intf, state):
+        if state == intf.state:
+            return
+
+        wasWaiting = intf.state & intfStateEnum.isWaitingMac
+        isWaiting = state & intfStateEnum.isWaitingMac
+        wasLLDP = intf.state & intfStateEnum.isWaitingLLDP
+        isLLDP = state & intfStateEnum.isWaitingLLDP
+        intf.state = state
+        intf.since = time.monotonic()
+
+        if isWaiting and not wasWaiting:
+            if not self.macWaiting:
+                self.watch_all_mac_entries(True)
+            self.trackWaiting(self.macWaiting, intf, True)
+        elif wasWaiting and not isWaiting:
+            self.trackWaiting(self.macWaiting, intf, False)
+            if not self.macWaiting:
+                self.watch_all_mac_entries(False)
+
+        if isLLDP != wasLLDP:
+            self.trackWaiting(self.lldpWaiting, intf, isLLDP)
+
+    # add an interface to, or take it off, a table of waiting interfaces
+    def trackWaiting(self, table, intf, waiting):
+        if waiting:
+            table.setdefault(intf.key, []).append(intf)
+            return
+        entries = table[intf.key]
+        entries.remove(intf)
+        if not entries:
+            del table[intf.key]
 
     def on_mac_entry_set(self, mac):
         # .intfs() will return a set of all the interfaces that this mac has been found on
         #   we need to loop over all of them and set each interface accordingly
-        intfIds = mac.intfs()
-        for intf in intfIds:
-            # loop over all the interfaces for this mac address.  if it is in our monitored
-            #   list we can remove it and run the requisite change to the interface if there
-            #   is a match
+        start = time.perf_counter()
+        self.metrics.count('macEvents')
+        processed = False
+        waitingMac = self.macWaiting
+        for intf in mac.intfs():
+            # loop over all the interfaces for this mac address.  most learns are on ports
+            #   that aren't waiting, so those are thrown away on the hash alone.  if it is
+            #   one of ours we can remove it and run the requisite change to the interface
+            #   if there is a match
+            waiting = waitingMac.get(intfKey(intf))
+            if not waiting:
+                continue
             intfStr = intf.to_string()
-            if intfStr in self.macInterfaces:
-                # we're processing this interface, regardless as to if there is a match.  we
-                #   should remove it from the monitored list
-                self.disableInterface(intfStr, mac=True, lldp=False)
-
-                macStr = mac.mac_key().eth_addr().to_string()
+            for state in waiting:
+                if state.name == intfStr:
+                    break
+            else:
+                continue
+            # we're processing this interface, regardless as to if there is a match.  we
+            #   should remove it from the monitored list
+            processed = True
+            self.disableInterface(intfStr, mac=True, lldp=False)
+
+            macStr = mac.mac_key().eth_addr().to_string()
+            macKey = 'mac:' + formatMac(macStr)
+            portConfig = self.cachedProfile(macKey)
+            if not portConfig:
                 portConfig = self.searchMAC(formatMac(macStr))
-                if not portConfig:
-                    self.tracer.trace2("we didn't find a match for mac {}".format(macStr))
-                    return
+                self.rememberProfile(macKey, portConfig)
+            if not portConfig:
+                self.tracer.trace2("we didn't find a match for mac {}", macStr)
+                self.recorder.record(intfStr, 'mac', macStr, None, time.perf_counter() - start)
+                return
+
+            if 'states' in portConfig and 'linkup' in portConfig['states']:
+                self.tracer.trace0("Setting a configuration on {}", intfStr)
+                self.configureInterface(intfStr, portConfig['states']['linkup'], portConfig.get('name', 'default'))
 
-                if 'states' in portConfig and 'linkup' in portConfig['states']:
-                    self.tracer.trace0("Setting a configuration on {}".format(intfStr))
-                    self.configureInterface(intfStr, portConfig['states']['linkup'])
+                # if we've configured the interface based on mac we should not monitor
+                #  for lldp messages any longer
+                self.disableInterface(intfStr, mac=False, lldp=True)
+                self.setIntfState(state, intfStateEnum.isConfigured)
 
-                    # if we've configured the interface based on mac we should not monitor
-                    #  for lldp messages any longer
-                    self.disableInterface(intfStr, mac=False, lldp=True)
+            self.recorder.record(intfStr, 'mac', macStr, portConfig.get('name', 'default'), time.perf_counter() - start)
+
+        if not processed:
+            self.metrics.count('macDropped')
 
     def on_lldp_intf_change(self, lldpNeighbor):
-        # here we'll look at the handler for the lldp neighbor learning
+        # here we'll look at the handler for the lldp neighbor learning.  every port
+        #  refreshes its neighbors every 30 seconds, so anything not on a port waiting
+        #  for lldp is thrown away on the IntfId hash before the sdk is asked for anything
+        start = time.perf_counter()
+        self.metrics.count('lldpEvents')
+        intfId = lldpNeighbor.intf()
+        waiting = self.lldpWaiting.get(intfKey(intfId))
+        if not waiting:
+            self.metrics.count('lldpDropped')
+            return
+        intfStr = intfId.to_string()
+        for state in waiting:
+            if state.name == intfStr:
+                break
+        else:
+            self.metrics.count('lldpDropped')
+            return
+
+        self.disableInterface(intfStr, mac=True, lldp=True)
+
+        # a neighbor already classified under this ruleset (after a flap, say) gets the
+        #  same answer again without being searched for, as long as it still advertises
+        #  the same name, description and capabilities.  the neighbor hash only covers
+        #  who it is, not what it says
         remoteSystem = self.lldpMgr.system_name(lldpNeighbor)
-        caps = self.lldpMgr.system_capabilities(lldpNeighbor)
-        intfStr = lldpNeighbor.intf().to_string()
         remoteDescription = self.lldpMgr.system_description(lldpNeighbor)
-        self.tracer.trace1(f"{remoteDescription}")
+        caps = self.lldpMgr.system_capabilities(lldpNeighbor)
+        if caps:
+            caps = self.convertLLDPCapsToInt(caps)
+        fingerprint = (self.configVersion, remoteSystem, remoteDescription, caps)
+        neighborKey = lldpNeighbor.hash()
+        seen = self.lldpNeighbors.get(neighborKey, None)
+        if seen and seen[0] == fingerprint:
+            self.metrics.count('lldpNeighborHits')
+            portConfig = seen[1]
+            self.tracer.trace1("lldp neighbor ***{}*** on ***{}*** is unchanged", remoteSystem, intfStr)
+        else:
+            self.tracer.trace1("found a new lldp neighbor ***{}*** on ***{}***", remoteSystem, intfStr)
+
+            deviceKey = 'lldp:' + self.lldpMgr.chassis_id(lldpNeighbor).repr()
+            portConfig = self.cachedProfile(deviceKey)
+            if not portConfig:
+                self.tracer.trace1("{}", remoteDescription)
+                # we may want to look at the mac address on the neighbor to see if it
+                #  also matches capabilities
+                mac = lldpIntfMac(self.lldpMgr.intf_id(lldpNeighbor))
+                portConfig = self.matchLLDP(caps, mac, remoteDescription, remoteSystem)
+                self.rememberProfile(deviceKey, portConfig)
+
+            self.lldpNeighbors[neighborKey] = (fingerprint, portConfig)
+            self.lldpNeighbors.move_to_end(neighborKey)
+            if len(self.lldpNeighbors) > lldpNeighborCacheSize:
+                self.lldpNeighbors.popitem(last=False)
+        self.tracer.trace1(" -- config is {}", portConfig)
+
+        if portConfig and 'states' in portConfig and 'linkup' in portConfig['states']:
+            self.tracer.trace0("Setting a configuration on {}", intfStr)
+            self.configureInterface(intfStr, portConfig['states']['linkup'], portConfig.get('name', 'default'))
+            self.setIntfState(state, intfStateEnum.isConfigured)
+
+        self.recorder.record(intfStr, 'lldp', remoteSystem, portConfig.get('name', 'default') if portConfig else None,
+                time.perf_counter() - start)
+
+    # a neighbor that went away takes its classification with it, so whatever shows up
+    #  on the port next is looked at afresh
+    def on_lldp_intf_del(self, lldpNeighbor):
+        self.lldpNeighbors.pop(lldpNeighbor.hash(), None)
+
+    # the profile a device was classified onto before, as long as the config hasn't
+    #  changed since, so a known device doesn't need searching for again
+    def cachedProfile(self, deviceKey):
+        contentHash = self.configs.get('contentHash', None)
+        if not self.knownDevices or not contentHash:
+            return None
 
-        self.tracer.trace1("found a new lldp neighbor ***{}*** on ***{}***".format(remoteSystem, intfStr))
+        name = self.knownDevices.get(deviceKey, contentHash)
+        portConfig = self.configs['profiles'].get(name, None) if name else None
+        self.metrics.count('knownDeviceHits' if portConfig else 'knownDeviceMisses')
+        self.scheduleDecisionFlush()
+        return portConfig
 
-        if intfStr in self.lldpInterfaces:
-            self.disableInterface(intfStr, mac=True, lldp=True)
+    # only a match on a config with a name of its own is remembered, not the default
+    def rememberProfile(self, deviceKey, portConfig):
+        contentHash = self.configs.get('contentHash', None)
+        if not self.knownDevices or not contentHash or not portConfig:
+            return
 
-            # we may want to look at the mac address on the neighbor to see if it also matches capabilities.
-            #  python3 introduced some changes with strings and bytes coming out of c-land.  as a result we are
-            #  kinda limited here in how we get the mac address out of the lldppdu passed to us from the sdk.
-            #  the only viable path for us is to use repr() and strip out some extra characters.
-            remoteMac = self.lldpMgr.intf_id(lldpNeighbor).repr()
-            mac = None
-            if (remoteMac[:4] == "MAC:"):
-                mac = formatMac(remoteMac[4:])
+        name = portConfig.get('name', None)
+        if name and self.configs['profiles'].get(name, None) is portConfig:
+            self.knownDevices.put(deviceKey, name, contentHash)
+            self.scheduleDecisionFlush()
+
+    def scheduleDecisionFlush(self):
+        if self.knownDevices.dirty and 'decisions' not in self.timers:
+            self.setTimer('decisions', self.decisionFlushInterval, self.flushDecisions)
+
+    def flushDecisions(self):
+        if self.knownDevices:
+            self.knownDevices.flush()
+
+    # ports that were already up before we started watching them never send a linkup, so
+    #  they'd sit unclassified until they flap.  one eapi request pulls the link state,
+    #  the mac table and the lldp neighbors, and it shares the interfaces key so it
+    #  always runs after the monitored interface list has been fetched
+    def reconcile(self):
+        if not self.reconcileOnStart or self.configVersion == 0:
+            return
 
-            portConfig = self.searchLLDP(caps, mac, remoteDescription, remoteSystem)
-            self.tracer.trace1(" -- config is {}".format(portConfig))
+        cmds = ['show interfaces status', 'show mac address-table', 'show lldp neighbors detail']
+        start = time.monotonic()
+
+        def reconcileFetched(t, error):
+            if error:
+                self.tracer.trace0("Could not fetch the current interface state to reconcile: {}", error)
+                return
+            status, macTable, neighbors = [result.get('result', {}) for result in t]
+            self.reconcileInterfaces(status, macTable, neighbors, start)
+
+        self.runEapi('interfaces', lambda node: node.enable(cmds), reconcileFetched)
+
+    # classify every monitored port that is up but hasn't seen a linkup yet in one sweep,
+    #  and commit whatever that decided as a single batch
+    def reconcileInterfaces(self, status, macTable, neighbors, start):
+        up = [intfStr for intfStr, info in status.get('interfaceStatuses', {}).items()
+              if info.get('linkStatus') == 'connected' and intfStr in self.intfStates
+              and self.intfStates[intfStr].state == intfStateEnum.isIdle]
+        if not up:
+            return
 
-            if portConfig and 'states' in portConfig and 'linkup' in portConfig['states']:
-                self.tracer.trace0("Setting a configuration on {}".format(intfStr))
-                self.configureInterface(intfStr, portConfig['states']['linkup'])
+        macs = {}
+        for entry in macTable.get('unicastTable', {}).get('tableEntries', []):
+            macs.setdefault(entry.get('interface'), []).append(formatMac(entry.get('macAddress', '')))
+        neighbors = neighbors.get('lldpNeighbors', {})
 
-    # by default we will remove all configuration from the interface before adding new
-    #  configuration specified in the conf file.  using a config session allows us to
-    #  potentially apply an identical configuration on the interface without causing
-    #  impact to network traffic
-    def configureInterface(self, intfStr, portConfig):
-        sessionID = uuid.uuid1()
-        commandSequence = ['configure session {}'.format(sessionID),
-                'default interface {}'.format(intfStr),
-                'interface {}'.format(intfStr) ] + portConfig + ['commit']
-        self.pyeapi.config(commandSequence, autoComplete=True)
+        self.holdConfigs = True
+        try:
+            for intfStr in up:
+                self.reconcileInterface(intfStr, macs.get(intfStr, []),
+                                        neighbors.get(intfStr, {}).get('lldpNeighborInfo', []))
+        finally:
+            self.holdConfigs = False
+        self.flushPendingConfigs(batch=True)
+
+        elapsed = (time.monotonic() - start) * 1000
+        self.tracer.trace0("reconciled {} interfaces that were already up in {:.1f}ms", len(up), elapsed)
+        self.agentMgr_.status_set("reconcileMs", "{:.1f}".format(elapsed))
+
+    # the same decision the event handlers would have come to had the port just come up.
+    #  a learned mac is used first, preferring one with a profile over the default, then
+    #  the lldp neighbor.  whatever hasn't been seen yet is left waiting
+    def reconcileInterface(self, intfStr, macs, neighbors):
+        start = time.perf_counter()
+        state = self.intfStates[intfStr]
+        portConfig = None
+        # what the decision came from, for the recorder.  plain reconcile when there was
+        #  nothing to go on yet
+        trigger, detail = 'reconcile', None
+        waitMac, waitLLDP = True, self.enableLLDP
+
+        if macs:
+            waitMac = False
+            trigger = 'reconcile-mac'
+            detail = next((mac for mac in macs if self.configs['macIndex'].lookup(mac)), macs[0])
+            portConfig = self.searchMAC(detail)
+
+        if not portConfig and waitLLDP and neighbors:
+            waitMac = waitLLDP = False
+            neighbor = neighbors[0]
+            trigger = 'reconcile-lldp'
+            detail = neighbor.get('systemName')
 
-    # this function will convert the lldp system capabilities to an integer
-    #  bitmask, which is how it's stored.  unfortunately the sdk doesn't
-    #  give me a way to get at that integer so i need to handle it myself
-    #  the way this is written is likely fragile, but I don't see the python
-    #  SDK defining the enum so we need to trust the documentation and that
-    #  it'll never change
-    def convertLLDPCapsToInt(self, lldpCaps):
-        result = lldpCapsEnum.isOther
-        
-        if lldpCaps.repeater():
-            result |= lldpCapsEnum.isRepeater
-        if lldpCaps.bridge():
-            result |= lldpCapsEnum.isBridge
-        if lldpCaps.vlan_ap():
-            result |= lldpCapsEnum.isAP
-        if lldpCaps.router():
-            result |= lldpCapsEnum.isRouter
-        if lldpCaps.telephone():
-            result |= lldpCapsEnum.isTelephone
-        if lldpCaps.docsis():
-            result |= lldpCapsEnum.isDocsis
-        if lldpCaps.station():
-            result |= lldpCapsEnum.isStation
+            mac = None
+            remoteIntf = neighbor.get('neighborInterfaceInfo', {})
+            if remoteIntf.get('interfaceIdType') == 'macAddress':
+                mac = formatMac(remoteIntf.get('interfaceId', '').strip('"'))
+            caps = neighbor.get('systemCapabilities', None)
+            if caps is not None:
+                caps = self.convertCapsDictToInt(caps)
+            portConfig = self.matchLLDP(caps, mac, neighbor.get('systemDescription'), detail)
+
+        profile = None
+        if portConfig and 'states' in portConfig and 'linkup' in portConfig['states']:
+            self.tracer.trace0("Setting a configuration on {}", intfStr)
+            profile = portConfig.get('name', 'default')
+            self.configureInterface(intfStr, portConfig['states']['linkup'], profile)
+            self.setIntfState(state, intfStateEnum.isConfigured)
+        else:
+            default = self.configs.get('default', [])
+            if 'states' in default and 'linkup' in default['states']:
+                self.tracer.trace0("Defaulting interface {}", intfStr)
+                self.configureInterface(intfStr, default['states']['linkup'], 'default')
+                profile = 'default'
+            waiting = (intfStateEnum.isWaitingMac if waitMac else 0) | (intfStateEnum.isWaitingLLDP if waitLLDP else 0)
+            self.setIntfState(state, waiting or intfStateEnum.isSettled)
 
-        return result
+        self.recorder.record(intfStr, trigger, detail, profile, time.perf_counter() - start)
 
-    # this function will convert the configuration file list of string lldp capabilites
-    #  to the integer form of them.  this function has the same caveats relating to the
-    #  SDK as the above function convertLLDPCapsToInt
-    def convertListOfCapsToInt(self, capsList):
-        if capsList == None:
-            return None
+    # by default we will remove all configuration from the interface before adding new
+    #  configuration specified in the conf file.  using a config session allows us to
+    #  potentially apply an identical configuration on the interface without causing
+    #  impact to network traffic.  if a batch window is set the configuration is held
+    #  for that long so that anything else arriving in the meantime shares one commit.
+    #  if we already applied exactly this profile to the interface there is nothing to
+    #  commit at all.  only the newest state of a port matters, so it replaces anything
+    #  still queued for that port, and if that takes the port back to what it already
+    #  has (a quick flap) nothing is sent at all
+    def configureInterface(self, intfStr, plan, profile=None):
+        fingerprint = (profile, plan.fingerprint)
+        queued = self.pendingConfigs.pop(intfStr, None)
+        if queued:
+            self.tracer.trace1("{} replaces the queued configuration on {}", profile, intfStr)
+            self.metrics.count('opsSuperseded')
+        previous = queued[3] if queued else self.appliedConfigs.get(intfStr, None)
+
+        if not self.verifyApplied and previous == fingerprint:
+            self.tracer.trace1("{} already has {} applied, skipping", intfStr, profile)
+            self.metrics.count('commitsSkipped')
+            self.appliedConfigs[intfStr] = fingerprint
+            return
 
-        result = lldpCapsEnum.isOther
+        # profile matches go out ahead of defaults when there is a backlog
+        self.appliedConfigs[intfStr] = fingerprint
+        self.pendingConfigs[intfStr] = (plan, fingerprint, 1 if profile == 'default' else 0, previous)
+        self.scheduleFlush()
 
-        for cap in capsList:
-            if cap == "isRepeater":
-                result |= lldpCapsEnum.isRepeater
-            elif cap == "isBridge":
-                result |= lldpCapsEnum.isBridge
-            elif cap == "isAP":
-                result |= lldpCapsEnum.isAP
-            elif cap == "isRouter":
-                result |= lldpCapsEnum.isRouter
-            elif cap == "isTelephone":
-                result |= lldpCapsEnum.isTelephone
-            elif cap == "isDocsis":
-                result |= lldpCapsEnum.isDocsis
-            elif cap == "isStation":
-                result |= lldpCapsEnum.isStation
+    def scheduleFlush(self):
+        if self.holdConfigs:
+            return
+        if self.batchWindow <= 0:
+            self.flushPendingConfigs()
+        elif 'batch' not in self.timers:
+            self.setTimer('batch', self.batchWindow, self.flushPendingConfigs)
+
+    # send the queued configurations, one interface at a time or all together when
+    #  batching.  an interface with a commit still in flight stays queued until that
+    #  commit is back, so whatever it changes to meanwhile goes out once.  every eapi
+    #  operation needs a token from the rate limit, whatever doesn't get one waits
+    def flushPendingConfigs(self, batch=None):
+        if batch is None:
+            batch = self.batchWindow > 0
+        ready = sorted((intfStr for intfStr in self.pendingConfigs if intfStr not in self.inFlight),
+                       key=lambda intfStr: self.pendingConfigs[intfStr][2])
+        if not ready:
+            return
 
-        return result
+        self.tracer.trace1("flushing {} pending interface configurations", len(ready))
+        for intfs in [ready] if batch else [[intfStr] for intfStr in ready]:
+            if not self.takeToken():
+                break
+            priority = min(self.pendingConfigs[intfStr][2] for intfStr in intfs)
+            pending = [(intfStr,) + self.pendingConfigs.pop(intfStr)[:2] for intfStr in intfs]
+            self.commitPending(pending, priority)
+
+    # the eapi rate limit is a token bucket holding up to a second of operations.  when
+    #  it runs dry the flush is tried again as soon as the next token is due
+    def takeToken(self):
+        if self.maxOpsPerSecond <= 0:
+            return True
+
+        now = eossdk.now()
+        self.opTokens = min(self.opTokens + (now - self.opTokensAt) * self.maxOpsPerSecond,
+                            max(self.maxOpsPerSecond, 1))
+        self.opTokensAt = now
+        if self.opTokens >= 1:
+            self.opTokens -= 1
+            return True
+
+        self.metrics.count('opsThrottled')
+        if 'rate' not in self.timers:
+            # at least a millisecond, so rounding can't leave it firing just short of a token
+            self.setTimer('rate', max((1 - self.opTokens) / self.maxOpsPerSecond, 0.001), self.flushPendingConfigs)
+        return False
+
+    def commitPending(self, pending, priority):
+        verify = self.verifyApplied
+        intfs = [intfStr for intfStr, _, _ in pending]
+        self.inFlight.update(intfs)
+
+        def batchDone(result, error):
+            self.inFlight.difference_update(intfs)
+            self.commitDone(pending, result, error)
+            if any(intfStr in self.pendingConfigs for intfStr in intfs):
+                self.scheduleFlush()
+
+        # a single configuration keeps its interface as the key so each port stays in
+        #  order.  batches share one key so they are committed one after another
+        key = pending[0][0] if self.batchWindow <= 0 and len(pending) == 1 else 'batch'
+        self.runEapi(key, lambda node: self.commitInterfaceConfigs(node, pending, verify), batchDone, priority)
+
+    def commitDone(self, pending, result, error):
+        if error:
+            self.tracer.trace0("Could not configure {}: {}", pending[0][0], error)
+            self.metrics.count('commitFailures')
+            self.forgetApplied(pending)
+            return
 
-    def searchLLDP(self, lldpCaps, mac, remoteDescription, remoteSystem):
-        # this function is getting a bit complex.  we have a lot of
-        #  optional checks to do for a full match.  we need to be
-        #  cautious
+        failures, skipped = result
+        failed = set()
+        for intfStr, e in failures:
+            self.metrics.count('commitFailures')
+            if intfStr == 'batch':
+                self.tracer.trace0("batch commit failed ({}), fell back to per interface commits", e)
+            else:
+                self.tracer.trace0("Could not configure {}: {}", intfStr, e)
+                self.forgetApplied([config for config in pending if config[0] == intfStr])
+                failed.add(intfStr)
+        for intfStr in skipped:
+            self.tracer.trace1("{} running config already matches, skipped", intfStr)
+
+        self.metrics.count('commitsSkipped', len(skipped))
+        self.metrics.count('commitsApplied', len([config for config in pending
+                if config[0] not in skipped and config[0] not in failed]))
+
+    # drop the fingerprint of configurations that didn't make it onto the interface,
+    #  unless something newer has been queued for it since
+    def forgetApplied(self, configs):
+        for intfStr, _, fingerprint in configs:
+            if self.appliedConfigs.get(intfStr, None) == fingerprint:
+                del self.appliedConfigs[intfStr]
+
+    # commit the pending configurations, all in one session if there is more than one.
+    #  if that fails each interface is retried in its own session so one broken
+    #  profile doesn't keep every other port from being configured.  this runs on the
+    #  worker threads, so it returns the failures and the interfaces that were
+    #  skipped rather than tracing them
+    def commitInterfaceConfigs(self, node, pending, verify=False):
+        skipped = []
+        if verify:
+            skipped = self.matchRunningConfigs(node, pending)
+            pending = [config for config in pending if config[0] not in skipped]
+            if not pending:
+                return [], skipped
+
+        if len(pending) == 1:
+            self.applyInterfaceConfigs(node, pending)
+            return [], skipped
 
-        result = None
+        try:
+            self.applyInterfaceConfigs(node, pending)
+            return [], skipped
+        except Exception as e:
+            failures = [('batch', e)]
 
-        if lldpCaps:
-            lldpCaps = self.convertLLDPCapsToInt(lldpCaps)
+        for config in pending:
+            try:
+                self.applyInterfaceConfigs(node, [config])
+            except Exception as e:
+                failures.append((config[0], e))
+        return failures, skipped
 
-        # main search loop
-        self.tracer.trace1("searching for an lldp based match")
-        for config in self.configs['configs']:
-            self.tracer.trace5(f"  - checking against config {config['config']['name']} ")
+    # read the running config of every pending interface in a single eapi request and
+    #  return the interfaces whose configuration is already exactly what we would apply
+    def matchRunningConfigs(self, node, pending):
+        candidates = [(intfStr, plan) for intfStr, plan, _ in pending]
 
-            configLLDP = config['config'].get('lldp', None)
+        try:
+            output = node.enable(['show running-config interfaces {}'.format(intfStr) for intfStr, _ in candidates],
+                    encoding='text')
+        except Exception:
+            return []
+
+        matched = []
+        for (intfStr, plan), response in zip(candidates, output):
+            running = [line.strip() for line in response.get('result', {}).get('output', '').splitlines()]
+            running = [line for line in running if line and line != '!' and not line.startswith('interface ')]
+            if running == plan.running:
+                matched.append(intfStr)
+        return matched
+
+    # apply a list of (interface, plan, fingerprint) in a single config session.  every
+    #  interface is defaulted before its own commands are entered
+    def applyInterfaceConfigs(self, node, configs):
+        commandSequence = []
+        for intfStr, plan, _ in configs:
+            commandSequence += plan.render(intfStr)
+        configSession(node, commandSequence, 'commit')
+
+    # the configuration is fetched, parsed, compiled and validated on the reload thread
+    #  so events keep being handled meanwhile.  a cached copy of a remote file goes
+    #  first so a restart isn't left waiting on the server.  loads run one at a time in
+    #  the order they were asked for, and the last one to produce a configuration wins
+    def reloadConfig(self, value):
+        if not self.interfacesKnown:
+            self.deferredConfig = value
+            return
+        if not self.reloads:
+            self.reloads = orderedWorkerPool(1, lambda: None)
+            self.watch_readable(self.reloads.readFd, True)
+
+        start = time.monotonic()
+        fetcher, vrf, timeout = self.fetcher, self.vrf, self.fetchTimeout
+        intfStr = min(self.intfStates, default=None)
+        done = lambda result, error: self.reloadDone(start, result, error)
+        self.reloads.submit('config', lambda node: self.loader.run(intfStr, self.loader.loadCached, value, fetcher), done)
+        self.reloads.submit('config', lambda node: self.loader.run(intfStr, self.loader.loadOption, value, fetcher, vrf, timeout), done)
+
+    # the first interface list is in (or couldn't be fetched), so a load waiting on it
+    #  can go ahead
+    def releaseConfig(self):
+        self.interfacesKnown = True
+        value, self.deferredConfig = self.deferredConfig, None
+        if value:
+            self.reloadConfig(value)
+
+    # the new ruleset replaces the old one in a single assignment on the event loop, so
+    #  every event is handled against one version or the other, never a mix
+    def reloadDone(self, start, result, error):
+        if error:
+            self.tracer.trace0("Could not load the configuration: {}", error)
+            return
+        configs, tracer, status, metrics = result
+        tracer.replay(self.tracer)
+        self.metrics.merge(metrics)
+        for name, value in status:
+            self.agentMgr_.status_set(name, value)
+        if configs is None or configs is self.configs:
+            return
 
-            if not configLLDP:
-                # this config item doesn't have any lldp to check, skip it
-                continue
+        first = self.configVersion == 0
+        self.configs = configs
+        self.configVersion += 1
+        elapsed = (time.monotonic() - start) * 1000
+        self.tracer.trace0("configuration version {} in place, reloaded in {:.1f}ms", self.configVersion, elapsed)
+        self.tracer.trace5("full config: {}", self.configs)
+        self.agentMgr_.status_set("configVersion", str(self.configVersion))
+        self.agentMgr_.status_set("configReloadMs", "{:.1f}".format(elapsed))
+
+        # ports that were up at startup waited for the first ruleset to be classified
+        if first and self.initialized:
+            self.reconcile()
+
+    # load the configuration again every refreshInterval.  a remote file sends the etag
+    #  of the copy we have, so an unchanged one costs a 304, and an unchanged local file
+    #  comes back from the parsed cache.  nothing more is queued while a load is running
+    def refreshConfig(self):
+        self.setTimer('refresh', self.refreshInterval, self.refreshConfig)
+        # like the option handler, an unset config leaves the current ruleset alone
+        value = self.agentMgr_.agent_option("config")
+        if value and (not self.reloads or self.reloads.pending == 0):
+            self.reloadConfig(value)
+
+    def connectEapi(self):
+        if os.path.exists(self.eapiSocket):
+            return eapiTransport(self.eapiSocket, self.eapiTimeout, self.eapiRetries)
+        return pyeapi.connect_to("localhost")
+
+    # replace the worker pool.  the old one finishes what it already has queued, and
+    #  is closed once that has come back, straight away if it had nothing
+    def startWorkers(self, workers):
+        if self.workers:
+            self.workers.stop()
+            self.retiredWorkers.append(self.workers)
+            self.closeRetired(self.workers)
+            self.workers = None
+        if workers:
+            self.workers = orderedWorkerPool(workers, self.connectEapi)
+            self.watch_readable(self.workers.readFd, True)
+        self.tracer.trace0("running eapi calls on {} background workers", workers)
+
+    # run fn(node) against eapi and hand callback(result, error) the outcome.  with
+    #  async workers this returns straight away and the callback runs from the sdk
+    #  event loop once the job is done, otherwise everything happens inline
+    def runEapi(self, key, fn, callback, priority=0):
+        if self.workers:
+            self.workers.submit(key, fn, callback, priority)
+            self.reportEapi(self.workers.pending, None)
+            return
 
-            configCaps = configLLDP.get('caps', None)
-            configDescriptions = configLLDP.get('descriptions', None)
-            configNames = configLLDP.get('names', None)
-
-            capsResult = None
-            descResult = None
-            nameResult = None
-            macsResult = None
-
-            if configCaps != None and lldpCaps:
-                # if this config has a caps defined in it, this will set capsResult to a
-                #  boolean reflecting if it's a match.  we can use the None vs Bool to
-                #  know later if a caps check was needed.
-                capsResult = configCaps == lldpCaps
-                self.tracer.trace5(f"      searching for capabilites {lldpCaps}: {capsResult}")
-
-            if configDescriptions != None and remoteDescription:
-                # if this config has a description defined in it, this will set descResult
-                #  to a boolean reflecting if it's a match.  we can use the None vs Bool to
-                #  know later if a descrition match was needed
-                descResult = False
-                for desc in configDescriptions:
-                    descResult = remoteDescription.lower().find(desc) >= 0
-                    if descResult:
-                        break
-                self.tracer.trace5(f"      searching for descriptions {configDescriptions}: {descResult}")
-                
-            if configNames != None and remoteSystem:
-                # if this config has a name defined in it, this will set nameResult
-                #  to a boolean reflecting if it's a match.  we can use the None vs Bool to
-                #  know later if a name match was needed
-                nameResult = False
-                for name in configNames:
-                    nameResult = remoteSystem.lower().find(name) >= 0
-                    if nameResult:
-                        break
-                self.tracer.trace5(f"      searching for names {configNames}: {nameResult}")
-                
-            if mac and (len(configLLDP.get('ouis', [])) or len(configLLDP.get('macs', []))):
-                # if this config has a mac matc, this will set macsResult
-                #  to a boolean reflecting if it's a match.  we can use the None vs Bool to
-                #  know later if a descrition match was needed
-                macsResult = self._searchMAC(configLLDP, mac) != None
-                self.tracer.trace5(f"      searching for a mac based match: {macsResult}")
-
-            # the determination of if this config is a match.  if *Result is None we didn't need to make the check
-            #  that's a different result than doing the check and getting false back.   basically if we have a False
-            #  on any *Result then this definitely wasn't a match
-            self.tracer.trace0(f"caps: {capsResult}, desc: {descResult}, name: {nameResult}, macs: {macsResult}")
-            if (
-                (capsResult == True or capsResult == None) and
-                (descResult == True or descResult == None) and
-                (nameResult == True or nameResult == None) and
-                (macsResult == True or macsResult == None)
-               ):
-                result = config['config']
+        start = time.monotonic()
+        try:
+            result, error = fn(self.pyeapi), None
+        except Exception as e:
+            result, error = None, e
+        self.reportEapi(0, time.monotonic() - start, takeMetrics(self.pyeapi))
+        callback(result, error)
+
+    def on_readable(self, fd):
+        for workers in [self.workers, self.reloads] + self.retiredWorkers:
+            if workers and workers.readFd == fd:
                 break
+        else:
+            return
 
-        return result
-
-    def _searchMAC(self, config, mac):
-        ouiResult = None
-        macResult = None
-
-        self.tracer.trace0(f"searching for a mac match in {config}")
-        # look for specific matches for each mac address in the mac table
-        if 'macs' in config and mac in config['macs']:
-            self.tracer.trace1("found a specific match for {} in {}".format(mac, config))
-            macResult = config
-        # look for oui matches
-        if 'ouis' in config and mac[:6] in config['ouis']:
-            self.tracer.trace1("found an oui match for {} in {}".format(mac, config))
-            ouiResult = config
-
-        if macResult:
-            return macResult
-        elif ouiResult:
-            return ouiResult
+        for callback, result, error, latency, metrics in workers.drain():
+            if workers is not self.reloads:
+                self.reportEapi(workers.pending, latency, metrics)
+            callback(result, error)
+
+        if workers in self.retiredWorkers:
+            self.closeRetired(workers)
+
+    def closeRetired(self, workers):
+        if workers.pending == 0:
+            self.watch_readable(workers.readFd, False)
+            self.retiredWorkers.remove(workers)
+            workers.close()
+
+    # runs for every eapi job, so it only touches the metrics.  publishMetrics puts the
+    #  queue depth and last latency in the agent status
+    def reportEapi(self, depth, latency, metrics=None):
+        self.metrics.gauge('eapiQueueDepth', depth)
+        if metrics:
+            self.metrics.merge(metrics)
+        if latency is not None:
+            self.metrics.observe('eapiCall', latency)
+            self.metrics.gauge('eapiLatencyMs', round(latency * 1000, 1))
+            self.tracer.trace2("eapi call took {:.1f}ms, {} still queued", latency * 1000, depth)
+
+    def dumpDecisions(self, path):
+        try:
+            with open(path, "w") as f:
+                self.recorder.dump(f)
+            self.tracer.trace0("Wrote {} recent decisions to {}", len(self.recorder.decisions), path)
+        except OSError as e:
+            self.tracer.trace0("Could not write decisions to {}: {}", path, e)
+
+    # push the metrics into the agent status so they show up in show daemon, and into
+    #  the metrics file if there is one, then schedule the next round
+    def publishMetrics(self):
+        summary = self.metrics.summary()
+        # the share of lldp events handled without asking the sdk about the neighbor.  a
+        #  neighbor found unchanged (lldpNeighborHits) still had its attributes read
+        if summary.get('lldpEvents', 0):
+            summary['lldpShortCircuitPct'] = round(100.0 * summary.get('lldpDropped', 0) / summary['lldpEvents'], 1)
+        for name, value in summary.items():
+            self.agentMgr_.status_set(name, str(value))
+
+        if self.metricsFile:
+            try:
+                with open(self.metricsFile + ".tmp", "w") as f:
+                    json.dump(summary, f, indent=2, sort_keys=True)
+                os.replace(self.metricsFile + ".tmp", self.metricsFile)
+            except OSError as e:
+                self.tracer.trace0("Could not write metrics to {}: {}", self.metricsFile, e)
+
+        if self.metricsInterval > 0:
+            self.setTimer('metrics', self.metricsInterval, self.publishMetrics)
+
+    # the sdk only gives us a single timeout per handler.  keep a small table of named
+    #  timers and always arm the sdk timeout for whichever is due first
+    def setTimer(self, name, delay, callback):
+        self.timers[name] = (eossdk.now() + delay, callback)
+        self.timeout_time_is(min(deadline for deadline, _ in self.timers.values()))
+
+    def on_timeout(self):
+        now = eossdk.now()
+        for name in [name for name, (deadline, _) in self.timers.items() if deadline <= now]:
+            # a callback may have rearmed one of the other due timers, so check again
+            timer = self.timers.get(name, None)
+            if timer and timer[0] <= now:
+                del self.timers[name]
+                timer[1]()
+
+        if self.timers:
+            self.timeout_time_is(min(deadline for deadline, _ in self.timers.values()))
+
+# offline classification of a device inventory, to check a config change against the
+#  devices it will meet before it goes anywhere near a switch.  records are read in
+#  batches, the macs of a batch are joined against the mac and oui tables in one go
+#  and the lldp fields are matched once per distinct neighbor.  a record gets the
+#  profile of its mac, then of its lldp fields, then the default
+class inventoryClassifier:
+    def __init__(self, rules):
+        self.rules = rules
+        self.configs = [config['config'] for config in rules.configs['configs']]
+        self.positions = {id(config):position for position, config in enumerate(self.configs)}
+        self.default = rules.configs.get('default', None)
+
+        self.names = [config.get('name', 'default') for config in self.configs]
+        self.byMac = [(name, 'mac') for name in self.names]
+        self.byLLDP = [(name, 'lldp') for name in self.names]
+
+        # records won by each config, records an earlier config took from it, and entries
+        #  that can never win because an earlier config already lists them
+        self.wins = [0] * len(self.configs)
+        self.shadowed = [0] * len(self.configs)
+        self.shadowedEntries = self.findShadowedEntries()
+        self.records = 0
+
+        # lldp results by (caps, mac, description, name).  the mac only matters if some
+        #  lldp section lists macs or ouis
+        self.lldpResults = {}
+        self.lldpUsesMac = any(entry[4] or entry[5] for entry in rules.configs['lldpMatcher'].entries)
+
+    # macs and ouis listed by a config that an earlier config already matches
+    def findShadowedEntries(self):
+        shadowed = collections.Counter()
+        macs = {}
+        ouis = {}
+        for position, config in enumerate(self.configs):
+            for key in config.get('macs', []):
+                if min(macs.get(key, position), ouis.get(key >> 24, position)) < position:
+                    shadowed[position] += 1
+                macs.setdefault(key, position)
+            for oui in config.get('ouis', []):
+                key = macToInt(oui, 6)
+                if key is None:
+                    continue
+                if ouis.get(key, position) < position:
+                    shadowed[position] += 1
+                ouis.setdefault(key, position)
+        return shadowed
+
+    # the inventory as batches of (mac, caps, name, description).  json lines or csv with
+    #  a header row, the caps either a list/dict or names separated by ; or spaces
+    def readInventory(self, fileHandle, batchSize):
+        first = fileHandle.readline()
+        if first.lstrip().startswith('{'):
+            fields = ('mac', 'caps', ('name', 'systemName'), ('description', 'systemDescription'))
+            rows = (json.loads(line) for line in itertools.chain([first], fileHandle) if line.strip())
+            rows = ([row.get(field) if isinstance(field, str) else row.get(field[0]) or row.get(field[1])
+                     for field in fields] for row in rows)
         else:
-            # we didn't find any mac or oui match in this config.
+            header = next(csv.reader([first]), [])
+            columns = [next((header.index(name) for name in names if name in header), None)
+                       for names in (('mac',), ('caps',), ('name', 'systemName'), ('description', 'systemDescription'))]
+            if None in columns:
+                rows = ([row[column] if column is not None and column < len(row) else None for column in columns]
+                        for row in csv.reader(fileHandle))
+            else:
+                rows = map(operator.itemgetter(*columns), csv.reader(fileHandle))
+
+        # the same few capability sets come up over and over
+        caps = {}
+        batch = []
+        for mac, cap, name, description in rows:
+            key = cap if isinstance(cap, (str, type(None))) else json.dumps(cap, sort_keys=True)
+            if key not in caps:
+                caps[key] = self.parseCaps(cap)
+            batch.append((formatMac(mac or ''), caps[key], name or None, description or None))
+            if len(batch) >= batchSize:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def parseCaps(self, caps):
+        if not caps:
             return None
+        if isinstance(caps, dict):
+            return self.rules.convertCapsDictToInt(caps)
+        if isinstance(caps, str):
+            caps = caps.replace(';', ' ').replace(',', ' ').split()
 
-    # the searchMAC() function will loop over all configurations in the conf file
-    #  and search for both an exact match, an oui match, then finally the default
-    #  returning the configurations in that order, or None if there is no default
-    def searchMAC(self, mac):
-        result = None
-
-        # main search loop
-        self.tracer.trace1("searching for {}".format(mac))
-        for config in self.configs['configs']:
-            result = self._searchMAC(config['config'], mac)
-            if result:
-                break
+        result = lldpCapsEnum.isOther
+        for cap in caps:
+            if cap.startswith('is'):
+                result |= self.rules.convertListOfCapsToInt([cap])
+            else:
+                result |= self.rules.convertCapsDictToInt({cap:True})
+        return result
 
-        if result:
-            self.tracer.trace0(f"we found a match in {result}")
-            return result
-        else:
-            # we didn't find any mac or oui match.  if there is a default, let's use it
-            self.tracer.trace0("we didn't find a match in any config")
-            return self.configs.get('default', None)
+    # (profile, trigger) for each record of a batch
+    def classify(self, batch):
+        macHits, ouiHits = self.rules.configs['macIndex'].lookupPositions([record[0] for record in batch])
+        matcher = self.rules.configs['lldpMatcher']
+        wins = self.wins
+        shadowed = self.shadowed
+        byMac = self.byMac
+        byLLDP = self.byLLDP
+        noMatch = ('default', 'default') if self.default else ('', 'none')
+        results = []
+
+        for (mac, caps, name, description), macHit, ouiHit in zip(batch, macHits, ouiHits):
+            if macHit >= 0 or ouiHit >= 0:
+                # when both match the config earlier in the file wins
+                if macHit < 0 or 0 <= ouiHit < macHit:
+                    macHit, ouiHit = ouiHit, macHit
+                wins[macHit] += 1
+                if ouiHit > macHit:
+                    shadowed[ouiHit] += 1
+                results.append(byMac[macHit])
+            elif caps is not None or name or description:
+                key = (caps, mac if self.lldpUsesMac else None, description, name)
+                hits = self.lldpResults.get(key, None)
+                if hits is None:
+                    if len(self.lldpResults) >= 100000:
+                        self.lldpResults.clear()
+                    hits = [self.positions[id(config)] for config in matcher.matches(caps, mac or None, description, name)]
+                    self.lldpResults[key] = hits
+                if hits:
+                    wins[hits[0]] += 1
+                    for hit in hits[1:]:
+                        shadowed[hit] += 1
+                    results.append(byLLDP[hits[0]])
+                else:
+                    results.append(noMatch)
+            else:
+                results.append(noMatch)
+
+        self.records += len(batch)
+        return results
+
+    def summary(self, elapsed, triggers):
+        lines = ["{} records in {:.2f}s ({:.0f} records/sec)".format(self.records, elapsed,
+                 self.records / elapsed if elapsed else 0)]
+        lines.append("  by mac {mac}, by lldp {lldp}, default {default}, unmatched {none}".format(
+                 **{trigger:triggers[trigger] for trigger in ('mac', 'lldp', 'default', 'none')}))
+
+        never = [self.names[position] for position, wins in enumerate(self.wins) if not wins]
+        lines.append("rules that never matched ({}): {}".format(len(never), ' '.join(never)))
+
+        shadowed = [position for position in range(len(self.configs))
+                    if self.shadowed[position] or self.shadowedEntries[position]]
+        lines.append("rules shadowed by an earlier rule ({}):".format(len(shadowed)))
+        for position in shadowed:
+            lines.append("  {}: {} records taken, {} macs/ouis listed earlier".format(
+                self.names[position], self.shadowed[position], self.shadowedEntries[position]))
+        return '\n'.join(lines)
+
+def classifyMain(argv):
+    parser = argparse.ArgumentParser(prog="autoPortConfigAgent.py classify",
+        description="classify a device inventory against a configuration without a switch")
+    parser.add_argument('config', help="local configuration file, json or yaml")
+    parser.add_argument('inventory', help="csv (with a header) or json lines of mac, caps, name, description.  - reads stdin")
+    parser.add_argument('-o', '--output', default='-', help="where the per record csv goes, stdout by default")
+    parser.add_argument('--batch', type=int, default=65536, help="records classified per batch")
+    args = parser.parse_args(argv)
+
+    rules = configRules(lazyTracer("autoPortConfigAgent"))
+    try:
+        with open(args.config, "r") as configFile:
+            rules.configs = rules.parseConfig(configFile)
+    except Exception as e:
+        sys.stderr.write("could not load {}: {}\n".format(args.config, e))
+        return 1
+
+    classifier = inventoryClassifier(rules)
+    inventory = sys.stdin if args.inventory == '-' else open(args.inventory, "r", newline='')
+    output = sys.stdout if args.output == '-' else open(args.output, "w", newline='')
+    start = time.monotonic()
+    try:
+        writer = csv.writer(output)
+        writer.writerow(['mac', 'name', 'profile', 'trigger'])
+        triggers = collections.Counter()
+        for batch in classifier.readInventory(inventory, max(args.batch, 1)):
+            results = classifier.classify(batch)
+            triggers.update(results)
+            writer.writerows((record[0], record[2] or '', profile, trigger)
+                             for record, (profile, trigger) in zip(batch, results))
+    finally:
+        if inventory is not sys.stdin:
+            inventory.close()
+        if output is not sys.stdout:
+            output.close()
+
+    byTrigger = collections.Counter()
+    for (_, trigger), count in triggers.items():
+        byTrigger[trigger] += count
+    sys.stderr.write(classifier.summary(time.monotonic() - start, byTrigger) + '\n')
+    return 0
+
+# turn a text mac list into the sorted binary form a macsFile can be mapped from
+def packMacsMain(argv):
+    parser = argparse.ArgumentParser(prog="autoPortConfigAgent.py packmacs",
+        description="write a text mac list as a sorted binary macsFile")
+    parser.add_argument('input', help="text file with one mac a line")
+    parser.add_argument('output', help="binary file to write, named .bin")
+    args = parser.parse_args(argv)
+
+    start = time.monotonic()
+    macs = sortedMacs(readMacs(args.input))
+    with open(args.output, 'wb') as fileHandle:
+        fileHandle.write(sortedMacsMagic)
+        macs.tofile(fileHandle)
+    sys.stderr.write("{} macs, {} bytes in {:.2f}s\n".format(len(macs), len(macs) * 8 + 8, time.monotonic() - start))
+    return 0
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["classify"]:
+        sys.exit(classifyMain(sys.argv[2:]))
+    if sys.argv[1:2] == ["packmacs"]:
+        sys.exit(packMacsMain(sys.argv[2:]))
+
     sdk = eossdk.Sdk()
-    _ = InterfaceMonitor(sdk.get_intf_mgr(), sdk.get_agent_mgr(), sdk.get_mac_table_mgr(), sdk.get_lldp_mgr())
+    _ = InterfaceMonitor(sdk.get_intf_mgr(), sdk.get_agent_mgr(), sdk.get_mac_table_mgr(), sdk.get_lldp_mgr(), sdk.get_timeout_mgr())
     sdk.main_loop(sys.argv)
@@ -0,0 +1,542 @@
+#!/usr/bin/python3
+# event storm benchmark for autoPortConfigAgent.py
+#
+# the agent normally only runs on a switch against the real eossdk and eapi.  this
+#  harness loads it against local stand-ins for the sdk managers and for the eapi
+#  connection (with a configurable simulated latency), replays synthetic event storms
+#  through the real handlers and reports throughput, handler latency and the number
+#  of eapi calls issued.  nothing here talks to a switch.
+#
+#  ./autoPortConfigBench.py --ports 384 --macs 200000 --profiles 500 --eapi-latency 20
+
+import argparse, http.server, json, os, random, select, socketserver, sys, threading, time, types
+
+# a simulated clock for the sdk timers.  the harness moves it forward to fire the
+#  batch window instead of sleeping through it
+class fakeClock:
+    now = 0.0
+
+class eapiStats:
+    calls = 0
+    commands = 0
+    latency = 0.0
+    interfaces = []
+    # what the switch reports as already up when the agent starts
+    connected = False
+    macTable = []
+    neighbors = {}
+
+#### eossdk stand-in
+
+class IntfId:
+    def __init__(self, name):
+        self.name = name
+
+    def to_string(self):
+        return self.name
+
+    def hash(self):
+        return hash(self.name)
+
+class Tracer:
+    def __init__(self, name):
+        pass
+
+    def enabled(self, level):
+        return False
+
+    def __getattr__(self, name):
+        if name.startswith('trace'):
+            return lambda msg: None
+        raise AttributeError(name)
+
+class AgentHandler:
+    def __init__(self, agentMgr):
+        pass
+
+class IntfHandler:
+    def __init__(self, intfMgr):
+        pass
+
+    def watch_all_intfs(self, enable):
+        pass
+
+    def watch_intf(self, intfId, enable):
+        pass
+
+class MacTableHandler:
+    def __init__(self, macMgr):
+        self.macWatch = False
+
+    def watch_all_mac_entries(self, enable):
+        self.macWatch = enable
+
+class LldpHandler:
+    def __init__(self, lldpMgr):
+        pass
+
+class TimeoutHandler:
+    def __init__(self, timeoutMgr):
+        self.deadline = None
+
+    def timeout_time_is(self, deadline):
+        self.deadline = deadline
+
+class FdHandler:
+    def __init__(self):
+        self.readable = set()
+
+    def watch_readable(self, fd, enable):
+        if enable:
+            self.readable.add(fd)
+        else:
+            self.readable.discard(fd)
+
+def makeEossdk():
+    module = types.ModuleType('eossdk')
+    for cls in (IntfId, Tracer, AgentHandler, IntfHandler, MacTableHandler, LldpHandler, TimeoutHandler, FdHandler):
+        setattr(module, cls.__name__, cls)
+    module.INTF_OPER_UP = 1
+    module.INTF_OPER_DOWN = 2
+    module.LLDP_INTF_MAC_ADDR = LLDP_INTF_MAC_ADDR
+    module.now = lambda: fakeClock.now
+    return module
+
+class agentMgr:
+    def __init__(self, options):
+        self.options = options
+        self.status = {}
+
+    def agent_option(self, name):
+        return self.options.get(name, "")
+
+    def status_set(self, name, value):
+        self.status[name] = value
+
+class intfMgr:
+    def admin_enabled(self, intfId):
+        return True
+
+LLDP_INTF_MAC_ADDR = 3
+
+class lldpCaps:
+    def __init__(self, caps):
+        self.caps = caps
+
+    def repeater(self):
+        return bool(self.caps & 1)
+
+    def bridge(self):
+        return bool(self.caps & 2)
+
+    def vlan_ap(self):
+        return bool(self.caps & 4)
+
+    def router(self):
+        return bool(self.caps & 8)
+
+    def telephone(self):
+        return bool(self.caps & 16)
+
+    def docsis(self):
+        return bool(self.caps & 32)
+
+    def station(self):
+        return bool(self.caps & 64)
+
+class lldpIntfId:
+    def __init__(self, mac):
+        self.mac = mac
+
+    def encoding(self):
+        return LLDP_INTF_MAC_ADDR
+
+    # the raw six bytes, as swig hands them over
+    def value(self):
+        return bytes.fromhex(self.mac.replace(':', '')).decode('utf-8', 'surrogateescape')
+
+    def repr(self):
+        return "MAC:" + self.mac
+
+class lldpChassisId:
+    def __init__(self, mac):
+        self.mac = mac
+
+    def repr(self):
+        return self.mac
+
+class lldpNeighbor:
+    def __init__(self, intf, name, caps, description, mac):
+        self.intfId = IntfId(intf)
+        self.name = name
+        self.caps = lldpCaps(caps)
+        self.description = description
+        self.mac = mac
+
+    def intf(self):
+        return self.intfId
+
+    # like the sdk's, who the neighbor is and not what it advertises
+    def hash(self):
+        return hash((self.intfId.name, self.mac))
+
+class lldpMgr:
+    def system_name(self, neighbor):
+        return neighbor.name
+
+    def system_capabilities(self, neighbor):
+        return neighbor.caps
+
+    def system_description(self, neighbor):
+        return neighbor.description
+
+    def chassis_id(self, neighbor):
+        return lldpChassisId(neighbor.mac)
+
+    def intf_id(self, neighbor):
+        return lldpIntfId(neighbor.mac)
+
+class ethAddr:
+    def __init__(self, mac):
+        self.mac = mac
+
+    def to_string(self):
+        return self.mac
+
+class macKey:
+    def __init__(self, mac):
+        self.addr = ethAddr(mac)
+
+    def eth_addr(self):
+        return self.addr
+
+    def hash(self):
+        return hash(self.addr.mac)
+
+class macEntry:
+    def __init__(self, mac, intf):
+        self.key = macKey(mac)
+        self.intfIds = [IntfId(intf)]
+
+    def mac_key(self):
+        return self.key
+
+    def intfs(self):
+        return self.intfIds
+
+#### pyeapi stand-in
+
+class eapiNode:
+    def call(self, commands):
+        commands = commands if isinstance(commands, list) else [commands]
+        eapiStats.calls += 1
+        eapiStats.commands += len(commands)
+        if eapiStats.latency:
+            time.sleep(eapiStats.latency)
+        return commands
+
+    def enable(self, commands, autoComplete=False, encoding='json'):
+        return [{'result':result} for result in self.answer(self.call(commands))]
+
+    # what the switch would send back for each command
+    def answer(self, commands):
+        results = []
+        for command in commands:
+            if command == 'show interfaces status':
+                results.append({'interfaceStatuses':{intf:{'linkStatus':'connected' if eapiStats.connected else 'notconnect'}
+                                                     for intf in eapiStats.interfaces}})
+            elif command == 'show mac address-table':
+                results.append({'unicastTable':{'tableEntries':eapiStats.macTable}})
+            elif command == 'show lldp neighbors detail':
+                results.append({'lldpNeighbors':eapiStats.neighbors})
+            elif command.startswith('show int'):
+                results.append({'interfaceStatuses':{intf:{} for intf in eapiStats.interfaces}})
+            elif command.startswith('show'):
+                results.append({'output':''})
+            else:
+                results.append({})
+        return results
+
+    # the first interface configured that the switch doesn't have, as a switch would
+    #  refuse it
+    def refused(self, commands):
+        for command in commands:
+            if command.startswith('interface ') and command[len('interface '):] not in eapiStats.interfaces:
+                return command
+        return None
+
+    def config(self, commands, autoComplete=False):
+        command = self.refused(self.call(commands))
+        if command:
+            raise sys.modules['pyeapi'].eapilib.CommandError("Invalid input: " + command)
+        return []
+
+# the eapi json-rpc server on a local unix socket, for running the agent's own eapi
+#  transport instead of the pyeapi stand-in.  the agent picks it up through its
+#  eapiSocket option
+class eapiHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        commands = eapiNode().call(request['params']['cmds'])
+        command = eapiNode().refused(commands)
+        if command:
+            reply = {'error':{'code':1002, 'message':"Invalid input: " + command, 'data':[{}] * commands.index(command)}}
+        else:
+            reply = {'result':eapiNode().answer(commands)}
+        body = json.dumps(dict(reply, jsonrpc='2.0', id=request['id'])).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class eapiServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def startEapiServer(path):
+    if os.path.exists(path):
+        os.unlink(path)
+    server = eapiServer(path, eapiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def makePyeapi():
+    module = types.ModuleType('pyeapi')
+    module.connect_to = lambda name: eapiNode()
+    module.eapilib = types.SimpleNamespace(CommandError=type('CommandError', (Exception,), {}))
+    return module
+
+def loadAgent():
+    sys.modules['eossdk'] = makeEossdk()
+    sys.modules['pyeapi'] = makePyeapi()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import autoPortConfigAgent
+    return autoPortConfigAgent
+
+#### scenarios
+
+def randomMac(rnd):
+    return ':'.join('{:02x}'.format(rnd.getrandbits(8)) for _ in range(6))
+
+# a config with profiles macs each, a few ouis, and lldp sections on some of them
+def makeConfig(rnd, profiles, macs):
+    configs = []
+    knownMacs = []
+    perProfile = max(macs // max(profiles, 1), 1)
+    for i in range(profiles):
+        config = {'name':'profile{}'.format(i), 'states':{'linkup':['description profile{}'.format(i)]}}
+        config['macs'] = [randomMac(rnd) for _ in range(perProfile)]
+        config['ouis'] = [randomMac(rnd)[:8] for _ in range(2)]
+        knownMacs += config['macs']
+        if i % 3 == 0:
+            config['lldp'] = {'caps':['isTelephone', 'isBridge'],
+                              'descriptions':['vendor{} phone'.format(i)],
+                              'names':['sep{:04x}'.format(i)]}
+        configs.append({'config':config})
+
+    result = {'default':{'states':{'linkup':['description default linkup'],
+                                   'linkdown':['description default linkdown']}},
+              'configs':configs}
+    return result, knownMacs
+
+class bench:
+    def __init__(self, agent, args):
+        self.agent = agent
+        self.args = args
+        self.rnd = random.Random(args.seed)
+        self.ports = ['Ethernet{}'.format(i) for i in range(1, args.ports + 1)]
+        eapiStats.interfaces = self.ports
+        eapiStats.latency = args.eapi_latency / 1000
+
+        self.config, self.knownMacs = makeConfig(self.rnd, args.profiles, args.macs)
+        self.configStr = json.dumps(self.config)
+
+    def monitor(self):
+        options = {'interfaces':'all', 'config':self.configStr, 'enableLLDP':'true', 'metricsInterval':'0',
+                   'batchWindow':str(self.args.batch_window), 'asyncWorkers':str(self.args.async_workers),
+                   'maxOpsPerSecond':str(self.args.max_ops), 'decisionStore':self.args.decision_store}
+        if self.args.eapi_socket:
+            options['eapiSocket'] = self.args.eapi_socket
+        fakeClock.now = 0.0
+        monitor = self.agent.InterfaceMonitor(intfMgr(), agentMgr(options), None, lldpMgr(), None)
+        monitor.on_initialized()
+        self.settle(monitor)
+        return monitor
+
+    # fire any due timers and wait for the background workers and the reload thread to
+    #  hand back their work
+    def settle(self, monitor):
+        while True:
+            if monitor.timers:
+                fakeClock.now = max(fakeClock.now, min(deadline for deadline, _ in monitor.timers.values()))
+                monitor.on_timeout()
+                continue
+
+            fds = list(monitor.readable)
+            pools = [pool for pool in [monitor.workers, monitor.reloads] + monitor.retiredWorkers if pool]
+            if not any(pool.pending for pool in pools):
+                return
+            ready, _, _ = select.select(fds, [], [], 1)
+            for fd in ready:
+                monitor.on_readable(fd)
+
+    # run events through handler, timing each call, then let queued work finish
+    def run(self, name, monitor, handler, events):
+        eapiStats.calls = 0
+        eapiStats.commands = 0
+        latencies = []
+        start = time.perf_counter()
+        for event in events:
+            before = time.perf_counter()
+            handler(*event)
+            latencies.append(time.perf_counter() - before)
+        handled = time.perf_counter() - start
+        if monitor:
+            self.settle(monitor)
+        total = time.perf_counter() - start
+        self.report(name, latencies, handled, total)
+
+    def report(self, name, latencies, handled, total):
+        latencies.sort()
+        count = len(latencies)
+        p50 = latencies[count // 2] if count else 0
+        p99 = latencies[min(int(count * 0.99), count - 1)] if count else 0
+        print("{:<12} {:>9} {:>12.0f} {:>10.1f} {:>10.1f} {:>10.2f} {:>7} {:>9}".format(
+            name, count, count / handled if handled else 0, p50 * 1e6, p99 * 1e6, total,
+            eapiStats.calls, eapiStats.commands))
+
+    def linkup(self):
+        monitor = self.monitor()
+        events = [(IntfId(port), 1) for port in self.ports]
+        self.run('linkup', monitor, monitor.on_oper_status, events)
+
+    # a learn flood where most of the macs are on a port we don't monitor (an uplink)
+    def macFlood(self):
+        monitor = self.monitor()
+        for port in self.ports:
+            monitor.on_oper_status(IntfId(port), 1)
+        self.settle(monitor)
+
+        uplink = 'Ethernet{}'.format(len(self.ports) + 1)
+        events = []
+        for _ in range(self.args.events):
+            if self.rnd.random() < self.args.uplink_fraction:
+                events.append((macEntry(randomMac(self.rnd), uplink),))
+            else:
+                mac = self.rnd.choice(self.knownMacs) if self.knownMacs and self.rnd.random() < 0.5 else randomMac(self.rnd)
+                events.append((macEntry(mac, self.rnd.choice(self.ports)),))
+        self.run('macflood', monitor, monitor.on_mac_entry_set, events)
+
+    # every port flaps a few times in a row, only the last state of each needs to reach
+    #  the switch
+    def flap(self):
+        monitor = self.monitor()
+        events = []
+        for _ in range(3):
+            events += [(IntfId(port), 2) for port in self.ports]
+            events += [(IntfId(port), 1) for port in self.ports]
+        self.run('flap', monitor, monitor.on_oper_status, events)
+
+    # every port sends the same lldp pdu over and over, after the first round nothing
+    #  about the neighbors changes
+    def lldpStorm(self):
+        monitor = self.monitor()
+        for port in self.ports:
+            monitor.on_oper_status(IntfId(port), 1)
+        self.settle(monitor)
+
+        neighbors = []
+        for i, port in enumerate(self.ports):
+            profile = 3 * (i % max(self.args.profiles // 3, 1))
+            neighbors.append(lldpNeighbor(port, 'SEP{:04X}'.format(profile), 18,
+                                          'Vendor{} Phone Model 1 firmware 1.0'.format(profile), randomMac(self.rnd)))
+        rounds = max(self.args.events // max(len(neighbors), 1), 1)
+        events = [(neighbor,) for _ in range(rounds) for neighbor in neighbors]
+        self.run('lldpstorm', monitor, monitor.on_lldp_intf_change, events)
+
+    # the lookups on their own against the large config
+    def lookups(self):
+        monitor = self.monitor()
+        macs = [(self.agent.formatMac(self.rnd.choice(self.knownMacs) if self.knownMacs and self.rnd.random() < 0.5
+                                      else randomMac(self.rnd)),) for _ in range(self.args.events)]
+        self.run('searchMAC', monitor, monitor.searchMAC, macs)
+
+        neighbors = []
+        for _ in range(self.args.events):
+            profile = self.rnd.randrange(max(self.args.profiles, 1))
+            neighbors.append((lldpCaps(18), None, 'Vendor{} Phone Model'.format(profile), 'SEP{:04X}'.format(profile)))
+        self.run('searchLLDP', monitor, monitor.searchLLDP, neighbors)
+
+    # an agent restart with every port already up, a third of them with a known mac, a
+    #  third with an lldp neighbor and an uplink full of macs.  the events are restarts
+    def restart(self):
+        macTable = []
+        neighbors = {}
+        uplink = 'Ethernet{}'.format(len(self.ports) + 1)
+        for i, port in enumerate(self.ports):
+            if i % 3 == 0 and self.knownMacs:
+                macTable.append({'interface':port, 'macAddress':self.rnd.choice(self.knownMacs)})
+            elif i % 3 == 1:
+                profile = 3 * (i % max(self.args.profiles // 3, 1))
+                neighbors[port] = {'lldpNeighborInfo':[{'systemName':'SEP{:04X}'.format(profile),
+                    'systemDescription':'Vendor{} Phone Model 1 firmware 1.0'.format(profile),
+                    'systemCapabilities':{'bridge':True, 'telephone':True},
+                    'neighborInterfaceInfo':{'interfaceIdType':'macAddress', 'interfaceId':'"{}"'.format(randomMac(self.rnd))}}]}
+        macTable += [{'interface':uplink, 'macAddress':randomMac(self.rnd)} for _ in range(self.args.events)]
+
+        eapiStats.connected, eapiStats.macTable, eapiStats.neighbors = True, macTable, neighbors
+        try:
+            # each monitor() settles itself, so the latency covers the whole sweep
+            self.run('restart', None, self.monitor, [()] * self.args.loads)
+        finally:
+            eapiStats.connected, eapiStats.macTable, eapiStats.neighbors = False, [], {}
+
+    def configLoad(self):
+        monitor = self.monitor()
+        eapiStats.calls = 0
+        eapiStats.commands = 0
+        # a fresh document each time so nothing is served from a cache.  the option
+        #  handler only queues the load, the total covers the reload thread's work
+        documents = []
+        for i in range(self.args.loads):
+            config = dict(self.config)
+            config['revision'] = i
+            documents.append(("config", json.dumps(config)))
+        self.run('configload', monitor, monitor.on_agent_option, documents)
+
+def main():
+    parser = argparse.ArgumentParser(description="replay synthetic event storms through autoPortConfigAgent")
+    parser.add_argument('--ports', type=int, default=48, help="monitored ports")
+    parser.add_argument('--profiles', type=int, default=100, help="configs in the generated config file")
+    parser.add_argument('--macs', type=int, default=10000, help="specific macs spread over the configs")
+    parser.add_argument('--events', type=int, default=20000, help="events per storm")
+    parser.add_argument('--uplink-fraction', type=float, default=0.9, help="share of mac learns on an unmonitored port")
+    parser.add_argument('--loads', type=int, default=5, help="config reloads to time")
+    parser.add_argument('--eapi-latency', type=float, default=0, help="simulated eapi latency in ms")
+    parser.add_argument('--batch-window', type=float, default=0, help="agent batchWindow option in ms")
+    parser.add_argument('--async-workers', type=int, default=0, help="agent asyncWorkers option")
+    parser.add_argument('--max-ops', type=float, default=0, help="agent maxOpsPerSecond option")
+    parser.add_argument('--decision-store', default='none', help="agent decisionStore option, none by default")
+    parser.add_argument('--eapi-socket', help="serve eapi on this unix socket and use the agent's own transport")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('scenarios', nargs='*', default=['linkup', 'flap', 'macflood', 'lldpstorm', 'lookups', 'restart', 'configload'])
+    args = parser.parse_args()
+
+    if args.eapi_socket:
+        startEapiServer(args.eapi_socket)
+    runner = bench(loadAgent(), args)
+    scenarios = {'linkup':runner.linkup, 'flap':runner.flap, 'macflood':runner.macFlood, 'lldpstorm':runner.lldpStorm,
+                 'lookups':runner.lookups, 'restart':runner.restart, 'configload':runner.configLoad}
+
+    print("{:<12} {:>9} {:>12} {:>10} {:>10} {:>10} {:>7} {:>9}".format(
+        'scenario', 'events', 'events/sec', 'p50 us', 'p99 us', 'total s', 'eapi', 'commands'))
+    for name in args.scenarios:
+        scenarios[name]()
+
+if __name__ == "__main__":
+    main()
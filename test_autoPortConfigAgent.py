@@ -0,0 +1,316 @@
+#!/usr/bin/python3
+# checks the compiled mac index and lldp matcher give the same answers as the linear
+#  searches they replaced, on randomized configs, the eapi transport against the
+#  bench's stand-in eapi server, and remote configuration loads against a local http
+#  server.  runs off box, without the sdk
+#
+#  python3 -m pytest test_autoPortConfigAgent.py
+
+import http.server, io, json, os, random, shutil, socket, tempfile, threading, unittest
+from unittest import mock
+
+import autoPortConfigAgent as agent
+import autoPortConfigBench as bench
+
+CAPS = ['isOther', 'isRepeater', 'isBridge', 'isAP', 'isRouter', 'isTelephone', 'isDocsis', 'isStation']
+
+def randomMac(rnd):
+    return ':'.join('{:02x}'.format(rnd.getrandbits(8)) for _ in range(6))
+
+# a config drawing its macs, ouis and lldp strings from small pools so configs overlap
+#  and shadow each other
+def randomConfig(rnd, profiles):
+    macs = [randomMac(rnd) for _ in range(200)]
+    ouis = [mac[:8] for mac in macs[:20]]
+    words = ['phone', 'camera', 'ap', 'vendor', 'model', 'sep', 'x1', 'x2']
+
+    configs = []
+    for i in range(profiles):
+        config = {'name':'profile{}'.format(i), 'states':{'linkup':['description profile{}'.format(i)]}}
+        if rnd.random() < 0.6:
+            config['macs'] = rnd.sample(macs, rnd.randint(1, 10))
+        if rnd.random() < 0.3:
+            config['ouis'] = rnd.sample(ouis, rnd.randint(1, 3))
+        if rnd.random() < 0.5:
+            lldp = {}
+            if rnd.random() < 0.7:
+                lldp['caps'] = rnd.sample(CAPS, rnd.randint(1, 3))
+            if rnd.random() < 0.5:
+                lldp['descriptions'] = [rnd.choice(words).upper() for _ in range(rnd.randint(1, 2))]
+            if rnd.random() < 0.5:
+                lldp['names'] = [rnd.choice(words) for _ in range(rnd.randint(1, 2))]
+            if rnd.random() < 0.2:
+                lldp['macs'] = rnd.sample(macs, 3)
+            if rnd.random() < 0.2:
+                lldp['ouis'] = rnd.sample(ouis, 1)
+            config['lldp'] = lldp
+        configs.append({'config':config})
+
+    document = {'configs':configs}
+    if rnd.random() < 0.5:
+        document['default'] = {'states':{'linkup':['description default']}}
+    return document, macs, words
+
+# the searches as they were before the rules were compiled, over the config as written
+class linearSearch:
+    def __init__(self, document):
+        self.default = document.get('default', None)
+        self.configs = []
+        for config in document['configs']:
+            config = config['config']
+            lldp = config.get('lldp', None)
+            if lldp is not None:
+                lldp = {'caps':agent.configRules.convertListOfCapsToInt(None, lldp.get('caps', None)),
+                        'descriptions':[desc.lower() for desc in lldp['descriptions']] if 'descriptions' in lldp else None,
+                        'names':[name.lower() for name in lldp['names']] if 'names' in lldp else None,
+                        'macs':list(map(agent.formatMac, lldp.get('macs', []))),
+                        'ouis':list(map(agent.formatMac, lldp.get('ouis', [])))}
+            self.configs.append((config['name'], {'macs':list(map(agent.formatMac, config.get('macs', []))),
+                                                   'ouis':list(map(agent.formatMac, config.get('ouis', [])))}, lldp))
+
+    @staticmethod
+    def macMatch(config, mac):
+        return mac in config['macs'] or mac[:6] in config['ouis']
+
+    def searchMAC(self, mac):
+        for name, macs, _ in self.configs:
+            if self.macMatch(macs, mac):
+                return name
+        return 'default' if self.default else None
+
+    def matchLLDP(self, lldpCaps, mac, remoteDescription, remoteSystem):
+        for name, _, lldp in self.configs:
+            if not lldp:
+                continue
+            if lldp['caps'] is not None and lldpCaps and lldp['caps'] != lldpCaps:
+                continue
+            if lldp['descriptions'] is not None and remoteDescription and \
+                    not any(remoteDescription.lower().find(desc) >= 0 for desc in lldp['descriptions']):
+                continue
+            if lldp['names'] is not None and remoteSystem and \
+                    not any(remoteSystem.lower().find(name) >= 0 for name in lldp['names']):
+                continue
+            if mac and (lldp['macs'] or lldp['ouis']) and not self.macMatch(lldp, mac):
+                continue
+            return name
+        return None
+
+class compiledSearchTest(unittest.TestCase):
+    def load(self, document):
+        rules = agent.configRules(agent.lazyTracer("autoPortConfigAgentTest"))
+        rules.configs = rules.parseConfig(io.StringIO(json.dumps(document)))
+        return rules
+
+    def testSearchMAC(self):
+        rnd = random.Random(1)
+        for _ in range(100):
+            document, macs, _ = randomConfig(rnd, rnd.randint(1, 30))
+            rules, linear = self.load(document), linearSearch(document)
+            queries = [agent.formatMac(rnd.choice(macs)) for _ in range(50)]
+            queries += [agent.formatMac(randomMac(rnd)) for _ in range(20)]
+            queries += [agent.formatMac(rnd.choice(macs))[:6] + agent.formatMac(randomMac(rnd))[6:] for _ in range(20)]
+            for mac in queries:
+                result = rules.searchMAC(mac)
+                self.assertEqual(result.get('name', 'default') if result else None, linear.searchMAC(mac), mac)
+
+    def testMatchLLDP(self):
+        rnd = random.Random(2)
+        for _ in range(100):
+            document, macs, words = randomConfig(rnd, rnd.randint(1, 30))
+            rules, linear = self.load(document), linearSearch(document)
+            for _ in range(100):
+                caps = rnd.choice([None, 0, rnd.getrandbits(7)] +
+                                  [rules.convertListOfCapsToInt(config['config']['lldp'].get('caps', None))
+                                   for config in document['configs'] if 'lldp' in config['config']])
+                mac = rnd.choice([None, agent.formatMac(rnd.choice(macs)), agent.formatMac(randomMac(rnd))])
+                description = rnd.choice([None, '', ' '.join(rnd.sample(words, 2)).title()])
+                system = rnd.choice([None, '', rnd.choice(words) + str(rnd.randint(0, 9))])
+                result = rules.matchLLDP(caps, mac, description, system)
+                self.assertEqual(result['name'] if result else None,
+                                 linear.matchLLDP(caps, mac, description, system),
+                                 (caps, mac, description, system))
+
+class eapiTransportTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'eapi.sock')
+        self.servers = []
+        bench.eapiStats.calls = bench.eapiStats.commands = 0
+        bench.eapiStats.latency = 0.0
+        bench.eapiStats.interfaces = ['Ethernet1', 'Ethernet2']
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(self.dir)
+
+    def serve(self):
+        server = bench.startEapiServer(self.path)
+        # a client that timed out leaves the handler writing to a closed socket
+        server.handle_error = lambda request, address: None
+        self.servers.append(server)
+
+    def testResults(self):
+        self.serve()
+        node = agent.eapiTransport(self.path)
+        results = node.enable(['show interfaces status', 'show version'])
+        self.assertEqual([result['command'] for result in results], ['show interfaces status', 'show version'])
+        self.assertEqual(sorted(results[0]['result']['interfaceStatuses']), ['Ethernet1', 'Ethernet2'])
+        self.assertEqual(results[1]['result'], {'output':''})
+        # the enable and configure in front aren't handed back
+        self.assertEqual(node.config(['interface Ethernet1', 'description x']), [{}, {}])
+        self.assertEqual((bench.eapiStats.calls, bench.eapiStats.commands), (2, 7))
+        node.close()
+
+    def testCommandRefused(self):
+        self.serve()
+        node = agent.eapiTransport(self.path)
+        with self.assertRaises(agent.eapiError) as raised:
+            node.config(['interface Ethernet9', 'description x'])
+        self.assertEqual(raised.exception.code, 1002)
+        self.assertTrue(agent.commandRefused(raised.exception))
+        self.assertFalse(agent.commandRefused(agent.eapiError("eapi returned http 500", 500)))
+        self.assertFalse(agent.commandRefused(OSError("unreachable")))
+        node.close()
+
+    def testRetryBackoff(self):
+        node = agent.eapiTransport(self.path, retries=3)
+        with mock.patch.object(agent.time, 'sleep') as sleep:
+            with self.assertRaises(OSError):
+                node.enable('show version')
+        self.assertEqual([call.args[0] for call in sleep.call_args_list], [0.05, 0.1, 0.2])
+        self.assertEqual(agent.takeMetrics(node).counters['eapiRetries'], 3)
+
+        # the server coming up while the agent backs off is picked up on the retry
+        with mock.patch.object(agent.time, 'sleep', side_effect=lambda delay: self.servers or self.serve()) as sleep:
+            self.assertEqual(node.enable('show version')[0]['result'], {'output':''})
+        self.assertEqual(sleep.call_count, 1)
+        node.close()
+
+    def testTimedOutConfigNotRetried(self):
+        self.serve()
+        bench.eapiStats.latency = 0.3
+        node = agent.eapiTransport(self.path, timeout=0.1, retries=2)
+        with self.assertRaises(socket.timeout):
+            node.config(['interface Ethernet1', 'description x'])
+        self.assertEqual(bench.eapiStats.calls, 1)
+
+        # a read can safely go again
+        with self.assertRaises(socket.timeout):
+            node.enable('show version')
+        self.assertEqual(bench.eapiStats.calls, 4)
+        node.close()
+
+# serves one configuration document with an etag and last-modified, answering 304 to a
+#  request that already has it, or fails every request with status if that is set
+class configHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        server = self.server
+        server.requests.append(dict(self.headers))
+        if server.status:
+            self.send_error(server.status)
+            return
+        if self.headers.get('If-None-Match') == server.etag:
+            self.send_response(304)
+            self.end_headers()
+            return
+
+        body = server.document.encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', server.etag)
+        self.send_header('Last-Modified', 'Sat, 17 Oct 2026 10:00:00 GMT')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def profileDocument(description):
+    return json.dumps({'configs':[{'config':{'name':'phones', 'macs':['00:11:22:33:44:55'],
+                                             'states':{'linkup':[description]}}}]})
+
+class remoteConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.cacheFile = os.path.join(self.dir, 'config.cache')
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), configHandler)
+        self.server.requests, self.server.status = [], None
+        self.publish('description v1', '"v1"')
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = 'http://127.0.0.1:{}/config.json'.format(self.server.server_address[1])
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.dir)
+
+    def publish(self, description, etag):
+        self.server.document, self.server.etag = profileDocument(description), etag
+
+    # a restarted agent: a new loader and fetcher on the same flash cache
+    def start(self):
+        return agent.configLoader(lambda: None), agent.configFetcher(self.cacheFile)
+
+    def load(self, loader, fetcher):
+        configs, _, _, _ = loader.run(None, loader.loadOption, self.url, fetcher, None, 5)
+        return configs
+
+    @staticmethod
+    def linkup(configs):
+        return configs['configs'][0]['config']['states']['linkup'].commands
+
+    def testConditionalFetch(self):
+        loader, fetcher = self.start()
+        self.assertEqual(self.linkup(self.load(loader, fetcher)), ['description v1'])
+        self.assertNotIn('If-None-Match', self.server.requests[-1])
+        with open(self.cacheFile) as f:
+            self.assertEqual(f.read(), profileDocument('description v1'))
+
+        # unchanged: the copy we have is offered and the server says 304
+        self.assertIsNone(self.load(loader, fetcher))
+        self.assertEqual(self.server.requests[-1]['If-None-Match'], '"v1"')
+        self.assertEqual(self.server.requests[-1]['If-Modified-Since'], 'Sat, 17 Oct 2026 10:00:00 GMT')
+
+        self.publish('description v2', '"v2"')
+        self.assertEqual(self.linkup(self.load(loader, fetcher)), ['description v2'])
+        with open(fetcher.metaFile) as f:
+            self.assertEqual(json.load(f)['etag'], '"v2"')
+
+        # a server that fails leaves the loaded copy in place
+        self.server.status = 500
+        self.assertIsNone(self.load(loader, fetcher))
+        self.assertEqual(fetcher.loaded, self.url)
+
+    def testRestartFromCache(self):
+        loader, fetcher = self.start()
+        self.load(loader, fetcher)
+        requests = len(self.server.requests)
+
+        # after a restart the flash copy is used before the server is asked anything
+        loader, fetcher = self.start()
+        configs, _, _, _ = loader.run(None, loader.loadCached, self.url, fetcher)
+        self.assertEqual(self.linkup(configs), ['description v1'])
+        self.assertEqual(len(self.server.requests), requests)
+        self.assertEqual(fetcher.loaded, self.url)
+        self.assertIsNone(loader.loadCached(self.url, fetcher))
+
+        # then the server is asked with the cached copy's etag, and a 304 keeps it
+        self.assertIsNone(self.load(loader, fetcher))
+        self.assertEqual(self.server.requests[-1]['If-None-Match'], '"v1"')
+
+        # the cache only stands in for the url it was fetched from
+        loader, fetcher = self.start()
+        self.assertIsNone(loader.loadCached(self.url + '?other', fetcher))
+
+    def testUnreachableWithoutCache(self):
+        self.server.status = 404
+        loader, fetcher = self.start()
+        self.assertIsNone(self.load(loader, fetcher))
+        self.assertIsNone(fetcher.loaded)
+        self.assertFalse(os.path.exists(self.cacheFile))
+
+if __name__ == "__main__":
+    unittest.main()